@@ -0,0 +1,337 @@
+import argparse
+import configparser
+import json
+import os
+import pathlib
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+devtools_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+stubs_dir = os.path.join(devtools_dir, "benchmarks", "stubs")
+
+# Mimics the dependency chain of the known projects. Every project also requires pyreq as python_requires.
+dependencies = {
+    "pyreq": [],
+    "cmake-modules": [],
+    "common": [],
+    "bettertest": ["common"],
+    "parsertongue": ["common"],
+    "math": ["common"],
+    "dot": ["common"],
+    "cppql": ["common"],
+    "sol": ["common", "math"],
+    "alexandria": ["common", "cppql", "parsertongue"]
+}
+
+# Projects that have cmake-modules as submodule.
+with_submodule = ["common", "bettertest", "parsertongue", "math", "dot", "cppql", "sol", "alexandria"]
+
+conanfile_template = """from conan import ConanFile
+
+class Recipe(ConanFile):
+    name = "{project}"
+    version = "{version}"
+    user = "timzoet"
+    channel = "v{version}"
+{python_requires}
+    def requirements(self):
+        pass
+{requires}
+"""
+
+source_template = """#include "{project}/file_{index}.h"
+
+namespace {namespace}
+{{
+    int function_{index}(const int value)
+    {{
+        int result = 0;
+        for (int i = 0; i < value; i++)
+        {{
+            if (i % {divisor} == 0) result += i;
+            else result -= {index};
+        }}
+        return result;
+    }}
+}}
+"""
+
+def git(*args, cwd=None) -> str:
+    return subprocess.check_output(["git", "-c", "user.name=devtools", "-c", "user.email=devtools@localhost",
+                                    "-c", "init.defaultBranch=master", *args], cwd=cwd, text=True,
+                                   stderr=subprocess.DEVNULL).strip()
+
+def get_versions(count: int):
+    return [f"1.{i}.0" for i in range(count)]
+
+def create_remotes(root: str, versions: int, files: int) -> None:
+    """Create a bare repository per project, with a tag per version. Every version changes the conanfile and all
+    sources, so that exports and formatting always have work to do after checking out another tag.
+    """
+    remotes = os.path.join(root, "remotes")
+    for project in dependencies:
+        with tempfile.TemporaryDirectory() as work:
+            git("init", "-q", work)
+            for version in get_versions(versions):
+                python_requires = ""
+                if project != "pyreq":
+                    python_requires = f'    python_requires = "pyreq/{version}@timzoet/v{version}"\n'
+                requires = "".join(f'        self.requires("{d}/{version}@timzoet/v{version}")\n'
+                                   for d in dependencies[project])
+                with open(os.path.join(work, "conanfile.py"), encoding="UTF8", mode="w") as f:
+                    f.write(conanfile_template.format(project=project, version=version,
+                                                      python_requires=python_requires, requires=requires))
+                with open(os.path.join(work, "CMakeLists.txt"), encoding="UTF8", mode="w") as f:
+                    f.write(f"cmake_minimum_required(VERSION 3.24)\nproject({project} VERSION {version})\n")
+
+                os.makedirs(os.path.join(work, "include", project), exist_ok=True)
+                os.makedirs(os.path.join(work, "src"), exist_ok=True)
+                for i in range(files if project not in ["pyreq", "cmake-modules"] else 0):
+                    with open(os.path.join(work, "include", project, f"file_{i}.h"), encoding="UTF8", mode="w") as f:
+                        f.write(f"#pragma once\n\nnamespace {project.replace('-', '_')}\n{{\n"
+                                f"    int function_{i}(int value);\n}}\n")
+                    with open(os.path.join(work, "src", f"file_{i}.cpp"), encoding="UTF8", mode="w") as f:
+                        f.write(source_template.format(project=project, namespace=project.replace("-", "_"),
+                                                       index=i, divisor=int(version.split(".")[1]) + 2))
+
+                git("add", "-A", cwd=work)
+                if project in with_submodule:
+                    # Register the submodule directly in the index, instead of cloning it into the working tree.
+                    modules = os.path.join(remotes, "cmake-modules.git")
+                    commit = git("rev-parse", f"v{version}^{{commit}}", cwd=modules)
+                    git("config", "-f", ".gitmodules", "submodule.cmake/modules.path", "cmake/modules", cwd=work)
+                    git("config", "-f", ".gitmodules", "submodule.cmake/modules.url", "../cmake-modules.git", cwd=work)
+                    git("add", ".gitmodules", cwd=work)
+                    git("update-index", "--add", "--cacheinfo", f"160000,{commit},cmake/modules", cwd=work)
+                git("commit", "-q", "-m", f"Version {version}", cwd=work)
+                git("tag", f"v{version}", cwd=work)
+
+            git("clone", "-q", "--bare", work, os.path.join(remotes, f"{project}.git"))
+
+def create_workspace(root: str, args) -> dict:
+    """Create the devtools root directory, stub executables and the environment to run devtools commands with."""
+    os.makedirs(os.path.join(root, "bin"), exist_ok=True)
+    os.makedirs(os.path.join(root, "conan", "profiles"), exist_ok=True)
+
+    config = configparser.ConfigParser()
+    config["default"] = {
+        "projectdir": os.path.join(root, "projects"),
+        "http": "True",
+        # A file URL instead of a plain path, since git ignores the clone strategy for local paths.
+        "url": pathlib.Path(root, "remotes").as_uri() + "/{project}.git"
+    }
+    config["conan"] = {"backend": "subprocess"}
+    config["clone"] = {"strategy": args.clone_strategy}
+    with open(os.path.join(root, "devtools.ini"), encoding="UTF8", mode="w") as f:
+        config.write(f)
+
+    with open(os.path.join(root, "conan", "profiles", "default"), encoding="UTF8", mode="w") as f:
+        f.write("[settings]\nos=Linux\narch=x86_64\nbuild_type=Release\n")
+
+    for name, script in [("conan", "fake_conan.py"), ("clang-format", "fake_clang_format.py")]:
+        path = os.path.join(root, "bin", name)
+        with open(path, encoding="UTF8", mode="w") as f:
+            f.write(f"#!{sys.executable}\nimport runpy\nrunpy.run_path({os.path.join(stubs_dir, script)!r}, "
+                    "run_name='__main__')\n")
+        os.chmod(path, 0o755)
+
+    env = dict(os.environ)
+    env.update({
+        "DEVTOOLS_ROOT_DIR": root,
+        "CONAN_HOME": os.path.join(root, "conan"),
+        "DEVTOOLS_CONAN_BACKEND": "subprocess",
+        "CLANG_FORMAT": os.path.join(root, "bin", "clang-format"),
+        "PATH": os.path.join(root, "bin") + os.pathsep + env.get("PATH", ""),
+        "FAKE_CONAN_LATENCY": str(args.conan_latency),
+        "FAKE_CLANG_FORMAT_LATENCY": str(args.clang_format_latency),
+        "FAKE_CLANG_FORMAT_FILE_LATENCY": str(args.clang_format_file_latency),
+        # Submodules are cloned from local paths, which git only allows when asked to.
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": "protocol.file.allow",
+        "GIT_CONFIG_VALUE_0": "always"
+    })
+    if args.clang_format:
+        env["CLANG_FORMAT"] = args.clang_format
+    return env
+
+def remove(*paths: str) -> None:
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def get_scenarios(root: str, jobs: int):
+    """List of (name, reset, devtools arguments). Reset puts the workspace in the state the scenario starts from. Cold
+    scenarios start from scratch, warm scenarios rerun the preceding cold scenario with its state left intact.
+    """
+    projects = os.path.join(root, "projects")
+    cache = os.path.join(root, "cache")
+    conan_cache = os.path.join(root, "conan", "fake-cache")
+
+    return [
+        ("clone-cold", lambda: remove(projects, os.path.join(cache, "mirrors")),
+         ["clone", "--jobs", str(jobs)]),
+        ("clone-warm", lambda: None,
+         ["clone", "--jobs", str(jobs)]),
+        ("clone-sync", lambda: None,
+         ["clone", "--sync"]),
+        ("export-cold", lambda: remove(conan_cache, os.path.join(cache, "export")),
+         ["export", "--jobs", str(jobs)]),
+        ("export-warm", lambda: None,
+         ["export", "--jobs", str(jobs)]),
+        ("export-deps-cold", lambda: remove(conan_cache, os.path.join(cache, "lockfiles"),
+                                            os.path.join(cache, "export"), os.path.join(cache, "mirrors")),
+         ["export-deps", "--project", "alexandria", "--profile", "default", "--jobs", str(jobs)]),
+        ("export-deps-warm", lambda: None,
+         ["export-deps", "--project", "alexandria", "--profile", "default", "--jobs", str(jobs)]),
+        ("conan-install", lambda: None,
+         ["conan-install", "--project", "alexandria", "--profile", "default"]),
+        ("clang-format-cold", lambda: None,
+         ["clang-format", "--project", "alexandria", "--no-cache", "--jobs", str(jobs)]),
+        ("clang-format-warm", lambda: None,
+         ["clang-format", "--project", "alexandria", "--jobs", str(jobs)]),
+        ("clang-format-check", lambda: None,
+         ["clang-format", "--project", "alexandria", "--check", "--no-cache", "--jobs", str(jobs)]),
+        ("startup", lambda: None,
+         ["--startup-time", "export"])
+    ]
+
+def get_commit() -> dict:
+    try:
+        commit = git("rev-parse", "HEAD", cwd=devtools_dir)
+        dirty = bool(git("status", "--porcelain", "--untracked-files=no", cwd=devtools_dir))
+    except subprocess.CalledProcessError:
+        commit, dirty = None, False
+    return {"commit": commit, "dirty": dirty}
+
+def run(args):
+    root = os.path.abspath(args.dir) if args.dir else tempfile.mkdtemp(prefix="devtools-benchmark-")
+    try:
+        print(f"Creating workspace in {root}.")
+        start = time.perf_counter()
+        create_remotes(root, args.versions, args.files)
+        env = create_workspace(root, args)
+        print(f"Workspace created in {time.perf_counter() - start:.2f} s.")
+
+        results = {}
+        for name, reset, argv in get_scenarios(root, args.jobs):
+            if args.scenarios and name not in args.scenarios:
+                continue
+
+            times = []
+            failures = 0
+            for _ in range(args.repeat):
+                reset()
+                start = time.perf_counter()
+                result = subprocess.run([sys.executable, os.path.join(devtools_dir, "devtools.py"), *argv], env=env,
+                                        cwd=root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+                times.append(time.perf_counter() - start)
+                if result.returncode != 0:
+                    failures += 1
+                    if args.verbose:
+                        print(result.stdout)
+
+            results[name] = {
+                "argv": argv,
+                "times": times,
+                "min": min(times),
+                "median": statistics.median(times),
+                "failures": failures
+            }
+            print(f"{name:<20}  min {min(times):>8.3f} s  median {statistics.median(times):>8.3f} s"
+                  f"{f'  ({failures} failed)' if failures else ''}")
+
+        report = {
+            **get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {
+                "versions": args.versions,
+                "files": args.files,
+                "jobs": args.jobs,
+                "repeat": args.repeat,
+                "conan_latency": args.conan_latency,
+                "clang_format_latency": args.clang_format_latency,
+                "clang_format_file_latency": args.clang_format_file_latency,
+                "clang_format": args.clang_format,
+                "clone_strategy": args.clone_strategy
+            },
+            "results": results
+        }
+
+        if args.output:
+            with open(args.output, encoding="UTF8", mode="w") as f:
+                json.dump(report, f, indent=4)
+            print(f"Results written to {args.output}.")
+        else:
+            print(json.dumps(report, indent=4))
+
+        if any(r["failures"] for r in results.values()):
+            sys.exit(1)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+def compare(args):
+    with open(args.compare[0], encoding="UTF8") as f:
+        old = json.load(f)
+    with open(args.compare[1], encoding="UTF8") as f:
+        new = json.load(f)
+
+    if old["parameters"] != new["parameters"]:
+        print("Warning: the results were produced with different parameters.")
+
+    print(f"{'scenario':<20}  {'old':>9}  {'new':>9}  {'change':>8}")
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            print(f"{name:<20}  {'-':>9}  {result['min']:>8.3f}s  {'-':>8}")
+            continue
+        before = old["results"][name]["min"]
+        change = (result["min"] - before) / before * 100 if before else 0.0
+        print(f"{name:<20}  {before:>8.3f}s  {result['min']:>8.3f}s  {change:>+7.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs devtools commands end to end against a synthetic workspace with\
+                                     local repositories and stub conan and clang-format executables. No network access\
+                                     is needed.")
+    parser.add_argument("--dir", dest="dir", required=False, help="Directory to create the workspace in. Defaults to a\
+                        temporary directory.")
+    parser.add_argument("--keep", dest="keep", action="store_true", help="Do not delete the workspace afterwards.")
+    parser.add_argument("--versions", dest="versions", type=int, required=False, default=2, help="Number of tagged\
+                        versions per project. Defaults to 2.")
+    parser.add_argument("--files", dest="files", type=int, required=False, default=200, help="Number of C++ source\
+                        and header pairs per project. Defaults to 200.")
+    parser.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, default=os.cpu_count(), help="Value\
+                        of the --jobs argument passed to all commands. Defaults to the number of cores.")
+    parser.add_argument("--repeat", dest="repeat", type=int, required=False, default=3, help="Number of runs per\
+                        scenario. Defaults to 3.")
+    parser.add_argument("--scenarios", nargs="*", required=False, help="Only run these scenarios.")
+    parser.add_argument("--conan-latency", dest="conan_latency", type=float, required=False, default=0.5,
+                        help="Seconds every conan call takes. Defaults to 0.5.")
+    parser.add_argument("--clang-format-latency", dest="clang_format_latency", type=float, required=False,
+                        default=0.05, help="Seconds every clang-format call takes. Defaults to 0.05.")
+    parser.add_argument("--clang-format-file-latency", dest="clang_format_file_latency", type=float, required=False,
+                        default=0.002, help="Seconds clang-format takes per file. Defaults to 0.002.")
+    parser.add_argument("--clang-format", dest="clang_format", required=False, help="Path to a real clang-format\
+                        executable to use instead of the stub.")
+    parser.add_argument("--clone-strategy", dest="clone_strategy", required=False, default="full", help="Clone\
+                        strategy used by the clone command. Defaults to full.")
+    parser.add_argument("--output", "-o", dest="output", required=False, help="File to write the JSON results to.\
+                        Defaults to stdout.")
+    parser.add_argument("--verbose", "-v", dest="verbose", action="store_true", help="Print the output of failed\
+                        runs.")
+    parser.add_argument("--compare", nargs=2, required=False, metavar=("OLD", "NEW"), help="Instead of running the\
+                        benchmarks, compare two result files.")
+
+    a = parser.parse_args()
+
+    if a.compare:
+        compare(a)
+    else:
+        run(a)
@@ -0,0 +1,29 @@
+"""Stand-in for clang-format, used by the benchmarks. It supports --version, -i and --output-replacements-xml.
+Formatting a file only reads it, files are never changed. The only formatting rule is that lines have no trailing
+whitespace, which is what --output-replacements-xml reports replacements for. Every call sleeps for
+FAKE_CLANG_FORMAT_LATENCY seconds, plus FAKE_CLANG_FORMAT_FILE_LATENCY seconds per file (both default 0).
+"""
+import os
+import re
+import sys
+import time
+from xml.sax.saxutils import quoteattr
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--version"]:
+        print("clang-format version 17.0.0 (fake)")
+        sys.exit(0)
+
+    time.sleep(float(os.getenv("FAKE_CLANG_FORMAT_LATENCY", "0")))
+
+    files = [a for a in sys.argv[1:] if not a.startswith("-")]
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        if "--output-replacements-xml" in sys.argv:
+            print("<?xml version='1.0'?>\n<replacements xml:space='preserve' incomplete_format='false'>")
+            for m in re.finditer(rb"[ \t]+(?=\r?\n|$)", data):
+                print(f"<replacement offset={quoteattr(str(m.start()))} length={quoteattr(str(len(m.group())))}>"
+                      "</replacement>")
+            print("</replacements>")
+        time.sleep(float(os.getenv("FAKE_CLANG_FORMAT_FILE_LATENCY", "0")))
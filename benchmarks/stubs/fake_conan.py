@@ -0,0 +1,189 @@
+"""Stand-in for the conan command line, used by the benchmarks. It implements just enough of export, list, remove,
+install, lock create and graph info to let the devtools commands run end to end with the subprocess Conan backend.
+
+Recipes are never executed. The name, version, user and channel are read from the conanfile, and requirements are
+found with the same pattern ConanUtils.find_requirements uses. Every call sleeps for FAKE_CONAN_LATENCY seconds
+(default 0) to simulate the startup and work of the real thing.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+requirement_pattern = re.compile(r"[a-z0-9_\-]+\/[a-zA-Z0-9_\.\-\+]+@timzoet\/[a-zA-Z0-9_\.\-\+]+")
+
+def get_cache() -> str:
+    path = os.path.join(os.getenv("CONAN_HOME"), "fake-cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def touch_database() -> None:
+    # Like the database of the real cache, this file is written whenever the contents of the cache change.
+    path = os.path.join(os.getenv("CONAN_HOME"), "p", "cache.sqlite3")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab"):
+        os.utime(path)
+
+def get_entry_path(ref: str) -> str:
+    return os.path.join(get_cache(), ref.replace("/", "+").replace("@", "+") + ".json")
+
+def read_entry(ref: str):
+    try:
+        with open(get_entry_path(ref), encoding="UTF8") as f:
+            return json.load(f)
+    except OSError:
+        return None
+
+def read_recipe(path: str):
+    with open(path, encoding="UTF8") as f:
+        text = f.read()
+    fields = dict(re.findall(r'^\s*(name|version|user|channel)\s*=\s*"([^"]*)"', text, re.MULTILINE))
+    ref = f"{fields['name']}/{fields['version']}@{fields['user']}/{fields['channel']}"
+    return ref, hashlib.sha1(text.encode()).hexdigest(), sorted(set(requirement_pattern.findall(text)))
+
+def resolve(conanfile: str):
+    """Resolve all requirements of a conanfile, returning the locked references and the missing ones."""
+    _, _, todo = read_recipe(conanfile)
+    locked = {}
+    missing = []
+    while todo:
+        ref = todo.pop()
+        if ref in locked or ref in missing:
+            continue
+        entry = read_entry(ref)
+        if entry is None:
+            missing.append(ref)
+            continue
+        locked[ref] = entry["revision"]
+        todo.extend(entry["requires"])
+    return locked, missing
+
+def get_options(args):
+    options = {}
+    positional = []
+    for a in args:
+        if a.startswith("-") and "=" in a:
+            key, value = a.split("=", 1)
+            options[key] = value
+        elif a.startswith("-"):
+            options[a] = True
+        else:
+            positional.append(a)
+    return options, positional
+
+def find_conanfile(path: str) -> str:
+    return path if path.endswith(".py") else os.path.join(path, "conanfile.py")
+
+def write_lockfile(path: str, locked) -> None:
+    requires = [f"{ref}#{rev}%0" for ref, rev in sorted(locked.items()) if not ref.startswith("pyreq/")]
+    python_requires = [f"{ref}#{rev}%0" for ref, rev in sorted(locked.items()) if ref.startswith("pyreq/")]
+    with open(path, encoding="UTF8", mode="w") as f:
+        json.dump({"version": "0.5", "requires": requires, "build_requires": [], "python_requires": python_requires}, f,
+                  indent=4)
+
+def export(args) -> int:
+    ref, revision, requires = read_recipe(find_conanfile(args[0]))
+    path = get_entry_path(ref)
+    with open(path + ".tmp", encoding="UTF8", mode="w") as f:
+        json.dump({"ref": ref, "revision": revision, "requires": requires}, f)
+    os.replace(path + ".tmp", path)
+    touch_database()
+    if "--format=json" in args:
+        print(f"{ref}: Exported: {ref}#{revision}", file=sys.stderr)
+        print(json.dumps({"reference": f"{ref}#{revision}"}))
+    else:
+        print(f"{ref}: Exported: {ref}#{revision}")
+    return 0
+
+def read_entries():
+    """Read all entries of the cache, together with the time they were last written."""
+    for name in sorted(os.listdir(get_cache())):
+        path = os.path.join(get_cache(), name)
+        if name.endswith(".json"):
+            with open(path, encoding="UTF8") as f:
+                yield json.load(f), os.path.getmtime(path)
+
+def parse_age(value: str) -> float:
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    return float(value[:-1]) * units[value[-1]]
+
+def list_(args) -> int:
+    options, positional = get_options(args)
+    pattern = positional[0].split("#")[0]
+    if not any(c in pattern for c in "*?["):
+        entry = read_entry(pattern)
+        if entry is None:
+            result = {pattern: {"error": f"Recipe '{pattern}' not found"}}
+        else:
+            result = {pattern: {"revisions": {entry["revision"]: {"timestamp": 0}}}}
+        print(json.dumps({"Local Cache": result}))
+        return 0
+
+    # The entries stand in for recipes, so the time an entry was last written is used as its last use for --lru.
+    cutoff = time.time() - parse_age(options["--lru"]) if "--lru" in options else None
+    result = {}
+    for entry, mtime in read_entries():
+        if fnmatch.fnmatch(entry["ref"], pattern) and (cutoff is None or mtime < cutoff):
+            result[entry["ref"]] = {"revisions": {entry["revision"]: {"timestamp": mtime}}}
+    print(json.dumps({"Local Cache": result}))
+    return 0
+
+def remove(args) -> int:
+    options, positional = get_options(args)
+    entries = list(read_entries())
+    if "--list" in options:
+        # A package list selects recipe revisions, or all revisions of a recipe if it lists none.
+        with open(options["--list"], encoding="UTF8") as f:
+            selected = json.load(f).get("Local Cache", {})
+        entries = [(e, m) for e, m in entries if e["ref"] in selected and
+                   e["revision"] in selected[e["ref"]].get("revisions", {e["revision"]: {}})]
+    else:
+        entries = [(e, m) for e, m in entries if fnmatch.fnmatch(e["ref"], positional[0].split("#")[0])]
+    for entry, _ in entries:
+        print(f"Removed recipe and all binaries of {entry['ref']}#{entry['revision']}")
+        os.remove(get_entry_path(entry["ref"]))
+        touch_database()
+    return 0
+
+def install(args) -> int:
+    options, positional = get_options(args)
+    locked, missing = resolve(find_conanfile(positional[0]))
+    if missing:
+        print(f"ERROR: Package '{missing[0]}' not resolved: Unable to find '{missing[0]}' in remotes", file=sys.stderr)
+        return 1
+    output_folder = options.get("-of", ".")
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, "conan_toolchain.cmake"), encoding="UTF8", mode="w") as f:
+        f.write(f"# Fake toolchain for profile {options.get('-pr:h')}.\n")
+    if "--lockfile-out" in options:
+        write_lockfile(options["--lockfile-out"], locked)
+    print(f"Generating files for {len(locked)} packages in {output_folder}")
+    return 0
+
+def lock(args) -> int:
+    options, positional = get_options(args[1:])
+    locked, missing = resolve(find_conanfile(positional[0]))
+    if missing:
+        print(f"ERROR: Package '{missing[0]}' not resolved", file=sys.stderr)
+        return 1
+    write_lockfile(options["--lockfile-out"], locked)
+    return 0
+
+def graph(args) -> int:
+    _, positional = get_options(args[1:])
+    _, missing = resolve(find_conanfile(positional[0]))
+    for ref in missing:
+        print(f"ERROR: Package '{ref}' not resolved", file=sys.stderr)
+    return 1 if missing else 0
+
+if __name__ == "__main__":
+    time.sleep(float(os.getenv("FAKE_CONAN_LATENCY", "0")))
+
+    commands = {"export": export, "list": list_, "remove": remove, "install": install, "lock": lock, "graph": graph}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(f"ERROR: Unsupported command {' '.join(sys.argv[1:])}", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(commands[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,41 @@
+import argparse
+import importlib
+import typing
+
+# All commands, as the name used on the command line, the module in this package, the command class and the help
+# text. Modules are only imported when their command runs, so listing the commands (e.g. for --help) imports none.
+registry = [
+    ("clang-format", "clang_format", "ClangFormatCommand", "Runs clang-format on a single project."),
+    ("clear-cache", "clear_cache", "ClearCacheCommand", "Removes all known or explicitly specified projects from the\
+     local Conan cache."),
+    ("clone", "clone", "CloneCommand", "Clones all known or explicitly specified projects."),
+    ("export", "export", "ExportCommand", "Exports packages to the local Conan cache."),
+    ("export-deps", "export_deps", "ExportDepsCommand", "Automatically resolves all required packages for a single\
+     project and exports them to the local Conan cache."),
+    ("cmake-generate", "cmake_generate", "CmakeGenerateCommand", "Runs the cmake generate command for a single\
+     project."),
+    ("conan-install", "conan_install", "ConanInstallCommand", "Runs the `conan install` command for one or more\
+     projects."),
+    ("daemon", "daemon", "DaemonCommand", "Starts, stops or queries a background process that runs commands, keeping\
+     Conan, the config and opened repositories warm between them."),
+    ("pipeline", "pipeline", "PipelineCommand", "Sets up one or more projects by running clone, export-deps,\
+     conan-install and cmake-generate in a single process."),
+    ("python-packages", "python_packages", "PythonPackagesCommand", "Installs required Python packages."),
+    ("status", "status", "StatusCommand", "Shows the state of all known or explicitly specified projects."),
+]
+
+def setup_commands(subparsers: argparse.ArgumentParser, argv: typing.List[str]) -> None:
+    """Add the subparsers of commands. If the arguments name a known command, only that command is imported and set up.
+    Otherwise (e.g. for --help), all commands are listed with their help text, without importing any of them.
+
+    Args:
+        subparsers (argparse.ArgumentParser): Subparsers object.
+        argv (typing.List[str]): Command line arguments, without the global options and their values.
+    """
+    names = [name for name, _, _, _ in registry]
+    selected = next((a for a in argv if not a.startswith("-")), None)
+    for name, module, cls, help in registry:
+        if selected not in names:
+            subparsers.add_parser(name, help=help)
+        elif selected == name:
+            getattr(importlib.import_module(f"{__name__}.{module}"), cls).setup(subparsers, help)
@@ -1,45 +1,111 @@
 import argparse
 import os
-import platform
-import subprocess
 import typing
 
-from utils import get_config, get_arg_project
-
-def get_clang_format_path() -> str:
-    return os.path.join(os.getenv("VCINSTALLDIR"), "Tools/Llvm/x64/bin/clang-format.exe")
+from formatutils import FormatCache, FormatUtils, config_files, extensions
+from gitutils import GitUtils
+from utils import get_cache_dir, get_config, get_arg_project
 
 class ClangFormatCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("clang-format", help="Runs clang-format on a single project.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("clang-format", help=help)
         p.add_argument("--project", dest="project", help="Project name. If not set, will try to derive current\
                         project from working directory.")
+        p.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, default=0, help="Number of\
+                        clang-format processes that run at the same time. Defaults to the number of cores.")
+        p.add_argument("--batch-size", dest="batch_size", type=int, required=False, default=50, help="Maximum\
+                        number of files passed to a single clang-format process. Defaults to 50.")
+        p.add_argument("--no-cache", dest="no_cache", action="store_true", help="Format all files, instead of\
+                        skipping files that have not changed since they were last formatted.")
+        p.add_argument("--check", dest="check", action="store_true", help="Only check whether files are formatted,\
+                        without modifying them. Fails if any file is not formatted.")
+        p.add_argument("--report", dest="report", required=False, help="With --check, write the unformatted files and\
+                        line ranges to this file. A JUnit report is written if it ends in .xml, JSON otherwise.")
+        p.add_argument("--max-violations", dest="max_violations", type=int, required=False, default=0, help="With\
+                        --check, stop once this many ranges of unformatted lines were found. Defaults to 0, which\
+                        checks all files.")
+        group = p.add_mutually_exclusive_group()
+        group.add_argument("--changed", dest="changed", action="store_true", help="Only format files that git reports\
+                           as staged, modified or untracked.")
+        group.add_argument("--staged", dest="staged", action="store_true", help="Only format files that are staged.")
+        group.add_argument("--since", dest="since", required=False, help="Only format files that changed since the\
+                           given ref, including uncommitted changes.")
         p.set_defaults(func=ClangFormatCommand.run)
 
     @staticmethod
     def run(args) -> typing.Iterable[str]:
         problems = []
-        if platform.system() != "Windows":
-            problems.append("clang-format is currently only supported on Windows.")
 
         known, project, _ = get_arg_project(args)
         if not known:
             problems.append(f"Unknown project {project}.")
             return problems
 
-        cf = get_clang_format_path()
-
-        def format_dir(folder: str) -> None:
-            for file in os.listdir(folder):
-                item = os.path.join(folder, file)
-                if os.path.isfile(item) and os.path.splitext(item)[1] in [".h", ".cpp"]:
-                    subprocess.check_call([cf, "-i", item])
-                elif os.path.isdir(item):
-                    format_dir(item)
+        cf = FormatUtils.find_clang_format()
+        if cf is None:
+            problems.append("Could not find clang-format. Add it to the PATH or set CLANG_FORMAT.")
+            return problems
 
         config = get_config()
         source = os.path.join(config["default"]["projectdir"], project, "source")
-        format_dir(source)
+        # Either ask git for the list of changed files, or walk the whole source folder.
+        git_mode = args.changed or args.staged or args.since
+        if git_mode:
+            try:
+                files = GitUtils.changed_files(source, args.since, args.staged, args.changed)
+                configs = GitUtils.tracked_files(source, *(f"*{c}" for c in config_files))
+            except Exception as e:
+                problems.append(f"Failed to list changed files in {source}: {e}")
+                return problems
+            files = [f for f in files if os.path.splitext(f)[1] in extensions]
+            configs = [c for c in configs if os.path.basename(c) in config_files]
+        else:
+            configs = []
+            files = FormatUtils.collect_files(source, configs)
+
+        # Skip all files that have not changed since they were last formatted with the same version and config.
+        cache = FormatCache(os.path.join(get_cache_dir("clang-format"), f"{project}.json"),
+                            FormatUtils.get_cache_key(cf, source, configs))
+        if not git_mode:
+            cache.prune(files)
+        todo = files if args.no_cache else [f for f in files if not cache.unchanged(f)]
+
+        if args.check:
+            print(f"Checking {len(todo)} of {len(files)} files in {source}.")
+            clean, violations, errors, complete = FormatUtils.check_files(cf, todo, args.jobs, args.batch_size,
+                                                                          args.max_violations)
+            problems.extend(errors)
+
+            # Files that are formatted are remembered, exactly like after formatting them.
+            for f in clean:
+                cache.update(f)
+            cache.save()
+
+            ClangFormatCommand.report(source, violations, complete)
+            if args.report:
+                # Files skipped through the cache are known to be formatted.
+                pending = set(todo)
+                checked = [f for f in files if f not in pending] + clean + list(violations)
+                FormatUtils.write_report(args.report, source, checked, violations, complete)
+            if violations:
+                problems.append(f"Found {len(violations)} unformatted files.")
+            return problems
+
+        print(f"Formatting {len(todo)} of {len(files)} files in {source}.")
+        formatted, errors = FormatUtils.format_files(cf, todo, args.jobs, args.batch_size)
+        problems.extend(errors)
+
+        for f in formatted:
+            cache.update(f)
+        cache.save()
 
         return problems
+
+    @staticmethod
+    def report(source: str, violations: typing.Dict[str, list], complete: bool) -> None:
+        for file in sorted(violations):
+            lines = ", ".join(f"{a}-{b}" if a != b else str(a) for a, b in violations[file])
+            print(f"{os.path.relpath(file, source)}: lines {lines}")
+        if not complete:
+            print("Stopped after reaching the maximum number of violations, not all files were checked.")
@@ -1,17 +1,117 @@
 import argparse
-import subprocess
+import fnmatch
+import time
 import typing
 
-from utils import known_projects
+from conanutils import ConanBackend, ExportRecord
+from utils import known_projects, filter_known_projects
 
 class ClearCacheCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("clear-cache", help="Removes all known projects from the local Conan cache.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("clear-cache", help=help)
+        p.add_argument("--projects", nargs="*", required=False, help="List of projects that are removed. If empty,\
+                       all known projects are removed. To only remove some versions, use 'project/tag', where the tag\
+                       matches the version or the tag of the package and may contain wildcards, e.g. common/v1.*.")
+        p.add_argument("--keep-latest", dest="keep_latest", type=int, required=False, help="Keep the latest N\
+                       revisions of each package version, and only remove the older ones.")
+        p.add_argument("--unused-days", dest="unused_days", type=int, required=False, help="Only remove revisions\
+                       that were not used for N days.")
+        p.add_argument("--dry-run", dest="dry_run", action="store_true", help="Only list what would be removed and\
+                       how much disk space it takes up, without removing anything.")
         p.set_defaults(func=ClearCacheCommand.run)
 
     @staticmethod
-    def run(_) -> typing.Iterable[str]:
-        for p in known_projects:
-            print(f"Removing {p}.")
-            subprocess.check_call(["conan", "remove", "-c", f"{p}/*"])
+    def run(args) -> typing.Iterable[str]:
+        problems = []
+
+        # Tag patterns to remove for each project, None meaning all of them.
+        selectors = {}
+        for p in filter_known_projects(args.projects) if args.projects else known_projects:
+            project, _, tag = p.partition("/")
+            if tag and selectors.get(project, []) is not None:
+                selectors.setdefault(project, []).append(tag)
+            else:
+                selectors[project] = None
+
+        # All packages are listed at once, and filtered here by project name. Like a {project}/* pattern for each
+        # project, this includes packages of any user and channel.
+        pattern = "*"
+        try:
+            revisions = ConanBackend.list_recipes(pattern)
+            if args.unused_days is not None:
+                unused = {ref for ref, _ in ConanBackend.list_recipes(pattern, args.unused_days)}
+            else:
+                unused = None
+        except Exception as e:
+            problems.append(f"Failed to list the packages in the Conan cache: {e}")
+            return problems
+
+        # Revisions that are kept because they are among the latest ones of their package version.
+        latest = set()
+        if args.keep_latest is not None:
+            versions = {}
+            for ref, timestamp in revisions:
+                versions.setdefault(ref.partition("#")[0], []).append((timestamp, ref))
+            for refs in versions.values():
+                latest.update(ref for _, ref in sorted(refs, reverse=True)[:args.keep_latest])
+
+        selected = []
+        for ref, timestamp in sorted(revisions):
+            name, version, channel = ClearCacheCommand.split(ref)
+            if name not in selectors or ref in latest or (unused is not None and ref not in unused):
+                continue
+            tags = selectors[name]
+            if tags is None or any(fnmatch.fnmatch(version, t) or fnmatch.fnmatch(channel, t) for t in tags):
+                selected.append((ref, timestamp))
+
+        if args.dry_run:
+            # Sizes take a walk over all folders of each revision, so they are only computed for a dry run.
+            sizes = ConanBackend.recipe_sizes([ref for ref, _ in selected])
+            ClearCacheCommand.report(selected, sizes)
+            if selected and sizes is None:
+                print("Sizes are only known when Conan runs in-process.")
+            print(f"{len(selected)} of {len(revisions)} revisions would be removed.")
+            return problems
+
+        ClearCacheCommand.report(selected, None)
+        try:
+            ConanBackend.remove([ref for ref, _ in selected])
+        except Exception as e:
+            problems.append(f"Failed to remove the packages from the Conan cache: {e}")
+            return problems
+        print(f"Removed {len(selected)} of {len(revisions)} revisions.")
+
+        # Without the packages in the cache, the fingerprints of previous exports no longer mean anything.
+        ExportRecord().forget(ClearCacheCommand.split(ref)[0] for ref, _ in selected)
+
+        return problems
+
+    @staticmethod
+    def split(ref: str) -> typing.Tuple[str, str, str]:
+        """Split a reference with revision into name, version and channel. The channel is empty for packages without
+        user and channel.
+        """
+        name_version, _, user_channel = ref.partition("#")[0].partition("@")
+        name, _, version = name_version.partition("/")
+        return name, version, user_channel.partition("/")[2]
+
+    @staticmethod
+    def report(selected: typing.List[typing.Tuple[str, float]], sizes: typing.Optional[typing.Dict[str, int]]) -> None:
+        if not selected:
+            return
+        width = max(len(ref) for ref, _ in selected)
+        print(f"{'revision':<{width}}  {'exported':<10}  {'size':>10}" if sizes is not None else
+              f"{'revision':<{width}}  exported")
+        for ref, timestamp in selected:
+            size = f"  {ClearCacheCommand.format_size(sizes[ref]):>10}" if sizes is not None else ""
+            print(f"{ref:<{width}}  {time.strftime('%Y-%m-%d', time.localtime(timestamp)):<10}{size}")
+        if sizes is not None:
+            print(f"{'total':<{width}}  {'':<10}  {ClearCacheCommand.format_size(sum(sizes.values())):>10}")
+
+    @staticmethod
+    def format_size(size: float) -> str:
+        for unit in ["B", "KiB", "MiB", "GiB"]:
+            if size < 1024 or unit == "GiB":
+                return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+            size /= 1024
@@ -2,16 +2,24 @@ import argparse
 import os
 import typing
 
-from gitutils import GitUtils
-from utils import known_projects, filter_known_projects, get_config
+from gitutils import GitUtils, clone_strategies
+from utils import known_projects, filter_known_projects, get_config, run_jobs, JobOutput
 
 class CloneCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("clone", help="Clones all known or explicitly specified projects.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("clone", help=help)
         p.add_argument("--projects", nargs="*", required=False, help="List of projects that are retrieved. If empty,\
                        all known projects are retrieved. To clone specific projects and specific tags, use\
                        'project/tag'.")
+        p.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, help="Number of repositories that are\
+                       cloned or synced at the same time. Defaults to 1, or to all of them with --sync.")
+        p.add_argument("--strategy", dest="strategy", choices=clone_strategies, required=False, help="How repositories\
+                       are cloned. Overrides the strategy option in the clone section of the devtools.ini file, which\
+                       defaults to full.")
+        p.add_argument("--sync", dest="sync", action="store_true", help="Fetch repositories that already exist and\
+                       fast-forward their current branch (or check out the specified tag). Repositories with\
+                       uncommitted changes or diverged branches are reported and left untouched.")
     
         p.set_defaults(func=CloneCommand.run)
     
@@ -26,12 +34,40 @@ class CloneCommand:
         else:
             projects = known_projects
 
-        problems = []
-
         config = get_config()
 
-        for p in projects:
-            source = os.path.join(config["default"]["projectdir"], p, "source")
-            GitUtils.open_or_clone_project(p, source, config)
+        states = {}
+
+        def clone(p: str, out: JobOutput) -> typing.Iterable[str]:
+            project, _, tag = p.partition("/")
+            source = os.path.join(config["default"]["projectdir"], project, "source")
+            if args.sync and os.path.exists(os.path.join(source, ".git")):
+                try:
+                    states[p] = GitUtils.sync(source, tag or None, out,
+                                              config.getint("clone", "submodule_jobs", fallback=8))
+                except Exception as e:
+                    out(f"Failed to sync due to the following error: {e}.")
+                    states[p] = "failed"
+                    return [f"Failed to sync {p} at {source}."]
+                out(f"{p}: {states[p]}.")
+                return []
+
+            _, problems = GitUtils.open_or_clone_project(p, source, config, out, args.strategy)
+            states[p] = "failed" if problems else "cloned"
+            return problems
+
+        # Syncing is mostly waiting on the network, so by default all repositories are fetched at the same time.
+        problems = run_jobs(projects, clone, args.jobs or (len(projects) if args.sync else 1))
+
+        if args.sync:
+            CloneCommand.report(projects, states)
 
         return problems
+
+    @staticmethod
+    def report(projects: typing.List[str], states: typing.Dict[str, str]) -> None:
+        print("")
+        width = max(len(p) for p in projects + ["project"])
+        print(f"{'project':<{width}}  state")
+        for p in projects:
+            print(f"{p:<{width}}  {states.get(p, '-')}")
@@ -1,22 +1,32 @@
 import argparse
+import configparser
+import hashlib
 import os
 import platform
 import subprocess
 import typing
 
-from utils import get_config, get_arg_project
+from tracing import span
+from utils import check_call_logged, get_config, get_arg_project
+
+# CMake files that CMake itself writes to the output folder, which therefore are not inputs.
+generated_files = ["cmake_install.cmake", "CTestTestfile.cmake", "CPackConfig.cmake", "CPackSourceConfig.cmake"]
 
 class CmakeGenerateCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("cmake-generate", help="Runs the cmake generate command for a single project.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("cmake-generate", help=help)
         p.add_argument("--project", dest="project", help="Project name. If not set, will try to derive current\
                         project from working directory.")
         p.add_argument("--output-folder", "--of", "-of", dest="output_folder", required=False, default="build",
                         help="Output folder, passed to the -of argument of the conan install command. If relative,\
                         it is joined with the current projects' root folder (i.e. next to the source folder.")
+        p.add_argument("--generator", "-G", dest="generator", required=False, help="CMake generator. Defaults to\
+                        Visual Studio 17 2022 on Windows and Ninja on Linux.")
+        p.add_argument("--force", dest="force", action="store_true", help="Always generate, even if none of the\
+                        inputs changed since the last successful run.")
         p.set_defaults(func=CmakeGenerateCommand.run)
-    
+
     @staticmethod
     def run(args) -> typing.Iterable[str]:
         problems = []
@@ -26,19 +36,91 @@ class CmakeGenerateCommand:
             problems.append(f"Unknown project {project}.")
             return problems
 
-        config = get_config()
+        return CmakeGenerateCommand.generate(get_config(), project, args.output_folder, args.generator, args.force)
+
+    @staticmethod
+    def generate(config: configparser.ConfigParser, project: str, output_folder: str,
+                 generator: typing.Optional[str] = None, force: bool = False,
+                 log: typing.Callable[..., None] = print) -> typing.Iterable[str]:
+        """Run the CMake generate step for a single project, unless none of its inputs changed since the last
+        successful run.
+
+        Args:
+            config (configparser.ConfigParser): Config.
+            project (str): Project name.
+            output_folder (str): Output folder. If relative, it is joined with the project folder.
+            generator (typing.Optional[str]): CMake generator. Defaults to the generator of the platform.
+            force (bool): Always generate.
+            log (typing.Callable[..., None]): Log function. Unless it is print, the output of CMake is passed to it
+            as well.
+
+        Returns:
+            typing.Iterable[str]: List of problems.
+        """
+        problems = []
 
         source = os.path.join(config["default"]["projectdir"], project, "source")
-        if os.path.isabs(args.output_folder):
-            target = args.output_folder
+        if os.path.isabs(output_folder):
+            target = output_folder
         else:
-            target = os.path.join(config["default"]["projectdir"], project, args.output_folder)
+            target = os.path.join(config["default"]["projectdir"], project, output_folder)
 
         if platform.system() == "Windows":
-            subprocess.check_call(["cmake", "-G", "Visual Studio 17 2022", "-A", "x64", "-T", "v143", "--toolchain",
-                                   "conan_toolchain.cmake", "-S", source, "-B", target])
+            generator = generator or "Visual Studio 17 2022"
         else:
-            problems.append("Cannot generate on any platforms other than Windows yet.")
-            return problems
+            generator = generator or "Ninja"
+        cmd = ["cmake", "-G", generator]
+        if generator.startswith("Visual Studio"):
+            cmd += ["-A", "x64", "-T", "v143"]
+        cmd += ["--toolchain", "conan_toolchain.cmake", "-S", source, "-B", target]
+
+        # Skip generating when none of the inputs changed since the last successful run.
+        fingerprint = CmakeGenerateCommand.fingerprint(cmd, source, target)
+        stamp = os.path.join(target, "devtools-cmake-fingerprint")
+        if not force and os.path.exists(os.path.join(target, "CMakeCache.txt")) and os.path.exists(stamp):
+            with open(stamp, encoding="UTF8") as f:
+                if f.read() == fingerprint:
+                    log(f"Skipping generate for {project}, nothing changed since the last run.")
+                    return problems
+
+        with span("cmake generate", project=project, generator=generator):
+            if log is print:
+                subprocess.check_call(cmd)
+            else:
+                check_call_logged(cmd, log)
+
+        with open(stamp, encoding="UTF8", mode="w") as f:
+            f.write(fingerprint)
 
         return problems
+
+    @staticmethod
+    def fingerprint(cmd: typing.List[str], source: str, target: str) -> str:
+        """Compute a fingerprint of all inputs of the generate step: the command line, all CMake files in the source
+        folder, the CMake files Conan generated in the output folder (including the toolchain) and everything in the
+        generators folder that Conan writes to when the recipe has a layout.
+
+        Args:
+            cmd (typing.List[str]): CMake command line.
+            source (str): Source folder.
+            target (str): Output folder.
+
+        Returns:
+            str: Fingerprint.
+        """
+        files = []
+        for root, dirs, filenames in os.walk(source):
+            dirs[:] = [d for d in dirs if d != ".git" and os.path.join(root, d) != target]
+            files.extend(os.path.join(root, f) for f in filenames if f == "CMakeLists.txt" or f.endswith(".cmake"))
+        if os.path.isdir(target):
+            files.extend(os.path.join(target, f) for f in os.listdir(target)
+                         if f.endswith(".cmake") and f not in generated_files)
+        for root, _, filenames in os.walk(os.path.join(target, "generators")):
+            files.extend(os.path.join(root, f) for f in filenames)
+
+        h = hashlib.sha256("\0".join(cmd).encode())
+        for path in sorted(files):
+            h.update(path.encode())
+            with open(path, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
@@ -1,64 +1,128 @@
 import argparse
 import os
-import subprocess
+import time
 import typing
 
-from utils import get_config, known_projects, get_arg_project
+from conanutils import ConanBackend, ConanUtils, LockfileStore
+from utils import get_config, resolve_project
 
 class ConanInstallCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("conan-install", help="Runs the `conan install` command for a single project.")
-        p.add_argument("--project", dest="project", help="Project name. If not set, will try to derive current\
-                           project from working directory.")
-        p.add_argument("--profile", dest="profile", required=True, help="Name of profile. Can be a profile stored\
-                           in the Conan cache, or in the current projects' buildtools/profiles folder. The latter takes\
-                           precedence.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("conan-install", help=help)
+        p.add_argument("--project", "--projects", nargs="+", dest="projects", required=False, help="Project names. If\
+                           not set, will try to derive current project from working directory.")
+        p.add_argument("--profile", "--profiles", nargs="+", dest="profiles", required=True, help="Names of profiles.\
+                           Can be a profile stored in the Conan cache, or in the current projects' buildtools/profiles\
+                           folder. The latter takes precedence.")
         p.add_argument("--build", nargs="*", dest="build", required=False, default=["missing:*"], help="List of\
                            values passed on directly to the --build argument of the conan install command. Defaults to\
                            'missing:*'.")
         p.add_argument("--output-folder", "--of", "-of", dest="output_folder", required=False, default="build",
                            help="Output folder, passed to the -of argument of the conan install command. If relative,\
-                           it is joined with the current projects' root folder (i.e. next to the source folder.")
+                           it is joined with the current projects' root folder (i.e. next to the source folder. When\
+                           installing for multiple profiles, a subfolder per profile is used.")
+        p.add_argument("--no-lockfile", dest="no_lockfile", action="store_true", help="Do not use or store a\
+                           lockfile for the project and profile.")
         p.set_defaults(func=ConanInstallCommand.run)
-    
+
     @staticmethod
     def run(args) -> typing.Iterable[str]:
         config = get_config()
 
         problems = []
 
-        project = args.project
-        if project is None:
-            project = os.path.basename(os.path.normpath(os.getcwd()))
-        if "/" in project:
-            project, _ = project.split("/")
-        if project not in known_projects:
-            problems.append(f"Unknown project {project}.")
-            return problems
+        projects = []
+        for p in args.projects or [None]:
+            known, project, _ = resolve_project(p)
+            if not known:
+                problems.append(f"Unknown project {project}.")
+                return problems
+            projects.append(project)
+        projects = list(dict.fromkeys(projects))
+        profiles = list(dict.fromkeys(args.profiles))
 
-        known, project, _ = get_arg_project(args)
-        if not known:
-            problems.append(f"Unknown project {project}.")
-            return problems
+        # A single install runs directly, without buffering its output.
+        if len(projects) == 1 and len(profiles) == 1:
+            return ConanInstallCommand.install(config, projects[0], profiles[0], args.build, args.output_folder,
+                                               use_lockfile=not args.no_lockfile)
+
+        # Installs download and build packages in the shared Conan cache, which is not safe to do from several
+        # processes at once, and in-process Conan calls are serialized anyway. So the matrix is installed one
+        # combination at a time.
+        durations = {}
+        for profile in profiles:
+            for project in projects:
+                start = time.perf_counter()
+                try:
+                    result = ConanInstallCommand.install(config, project, profile, args.build,
+                                                         os.path.join(args.output_folder, os.path.basename(profile)),
+                                                         use_lockfile=not args.no_lockfile)
+                except Exception as e:
+                    result = [f"Failed to install {project} for {profile}: {e}"]
+                durations[(project, profile)] = (time.perf_counter() - start, not result)
+                problems.extend(result)
+
+        ConanInstallCommand.report(projects, profiles, durations)
+
+        return problems
+
+    @staticmethod
+    def install(config, project: str, profile: str, build: typing.List[str], output_folder: str,
+                log: typing.Callable[..., None] = print, use_lockfile: bool = True) -> typing.Iterable[str]:
+        """Run `conan install` for a single project and profile. A stored lockfile is used if it is still valid, and
+        the lockfile is updated afterwards.
+
+        Args:
+            config (configparser.ConfigParser): Config.
+            project (str): Project name.
+            profile (str): Profile name.
+            build (typing.List[str]): Values for the --build argument.
+            output_folder (str): Output folder. If relative, it is joined with the project folder.
+            log (typing.Callable[..., None]): Log function.
+            use_lockfile (bool): Use and store a lockfile.
+
+        Returns:
+            typing.Iterable[str]: List of problems.
+        """
+        problems = []
 
         source = os.path.join(config["default"]["projectdir"], project, "source")
-        if os.path.isabs(args.output_folder):
-            target = args.output_folder
+        if os.path.isabs(output_folder):
+            target = output_folder
         else:
-            target = os.path.join(config["default"]["projectdir"], project, args.output_folder)
-        build = [f"--build={b}" for b in args.build]
+            target = os.path.join(config["default"]["projectdir"], project, output_folder)
         conanfile = os.path.join(source, "conanfile.py")
-        if os.path.exists(os.path.join(source, "buildtools", "profiles", args.profile)):
-            profile = os.path.join(source, "buildtools", "profiles", args.profile)
-        else:
-            profile = args.profile
 
         if not os.path.exists(conanfile):
             problems.append(f"Could not find {conanfile}.")
             return problems
 
-        subprocess.check_call(["conan", "install", f"-pr:h={profile}", f"-pr:b={profile}", *build, f"-of={target}",
-                               source])
+        log(f"Installing {project} for {profile} to {target}.")
+        profile = ConanUtils.find_profile(source, profile)
+        if not use_lockfile:
+            ConanBackend.install(source, profile, build, target, log)
+            return problems
+
+        store = LockfileStore(project, source, profile)
+        lockfile = store.get()
+        if lockfile:
+            log(f"Using stored lockfile {lockfile}.")
+        ConanBackend.install(source, profile, build, target, log, lockfile, store.path)
+        store.update()
 
         return problems
+
+    @staticmethod
+    def report(projects: typing.List[str], profiles: typing.List[str],
+               durations: typing.Dict[typing.Tuple[str, str], typing.Tuple[float, bool]]) -> None:
+        print("")
+        width = max(len(p) for p in projects + ["project"])
+        print(f"{'project':<{width}}  {'profile':<30}  {'result':<6}  {'time':>8}")
+        for project in projects:
+            for profile in profiles:
+                if (project, profile) in durations:
+                    duration, success = durations[(project, profile)]
+                    print(f"{project:<{width}}  {profile:<30}  {'ok' if success else 'failed':<6}  {duration:>7.1f}s")
+                else:
+                    print(f"{project:<{width}}  {profile:<30}  {'-':<6}  {'-':>8}")
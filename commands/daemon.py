@@ -0,0 +1,63 @@
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import time
+import typing
+
+import daemonutils
+from utils import get_config
+
+class DaemonCommand:
+    @staticmethod
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("daemon", help=help)
+        p.add_argument("action", choices=["start", "stop", "status"], help="Start the daemon, stop it, or report\
+                       whether it is running.")
+        p.add_argument("--idle-timeout", dest="idle_timeout", type=float, required=False, help="Minutes without\
+                       commands after which the daemon stops. Overrides the idle_timeout_minutes option in the daemon\
+                       section of the devtools.ini file, which defaults to 30.")
+        p.set_defaults(func=DaemonCommand.run)
+
+    @staticmethod
+    def run(args) -> typing.Iterable[str]:
+        problems = []
+
+        if platform.system() == "Windows":
+            problems.append("The daemon is not supported on Windows.")
+            return problems
+
+        status = daemonutils.request("status")
+
+        if args.action == "status":
+            if status:
+                print(f"Daemon {status['pid']} is running for {status['uptime'] / 60:.1f} minutes and handled"
+                      f" {status['handled']} commands.")
+            else:
+                print("Daemon is not running.")
+        elif args.action == "stop":
+            if status:
+                daemonutils.request("stop")
+                print(f"Stopped daemon {status['pid']}.")
+            else:
+                print("Daemon is not running.")
+        elif status:
+            print(f"Daemon {status['pid']} is already running.")
+        else:
+            timeout = args.idle_timeout or get_config().getfloat("daemon", "idle_timeout_minutes", fallback=30)
+            subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "devtools.py"), "--serve", str(timeout)], stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+            # Wait until the daemon accepts commands.
+            deadline = time.monotonic() + 10
+            while status is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+                status = daemonutils.request("status")
+            if status is None:
+                problems.append("Daemon did not start.")
+            else:
+                print(f"Started daemon {status['pid']}, it stops after {timeout:g} minutes without commands.")
+
+        return problems
@@ -1,18 +1,24 @@
 import argparse
+import os
+import time
 import typing
 
-from conanutils import ConanUtils
-from utils import get_config, filter_known_projects, known_projects
+from conanutils import ConanUtils, ExportRecord
+from utils import get_config, filter_known_projects, known_projects, run_jobs, topological_waves, JobOutput
 
 class ExportCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("export", help="Exports packages to the local Conan cache.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("export", help=help)
         p.add_argument("--projects", nargs="*", required=False, help="List of projects that are exported to the Conan\
                        cache. If empty, all known projects are exported. To export specific projects and specific tags,\
                        use 'project/tag'.")
+        p.add_argument("--force", dest="force", action="store_true", help="Export all projects, instead of skipping\
+                       projects that did not change since their last export.")
+        p.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, default=os.cpu_count(), help="Number of\
+                       independent projects that are exported at the same time. Defaults to the number of cores.")
         p.set_defaults(func=ExportCommand.run)
-    
+
     @staticmethod
     def run(args) -> typing.Iterable[str]:
         if args.projects:
@@ -23,10 +29,72 @@ class ExportCommand:
         problems = []
 
         config = get_config()
+        record = ExportRecord()
 
+        # Build the dependency graph between the exported projects from the requirements in their conanfiles.
+        requires = {}
         for p in projects:
-            success, err = ConanUtils.export(config, p)
-            if not success:
-                problems.append(err)
+            name, _, tag = p.partition("/")
+            conanfile = os.path.join(config["default"]["projectdir"], name, "source", "conanfile.py")
+            try:
+                names = {ConanUtils.split_reference(r)[0] for r in ConanUtils.find_requirements(conanfile, tag)}
+            except Exception as e:
+                print(f"Failed to read requirements of {p} due to the following error: {e}.")
+                names = set()
+            requires[p] = [q for q in projects if q.split("/")[0] in names and q != p]
+
+        try:
+            waves = topological_waves(requires)
+        except RuntimeError as e:
+            problems.append(str(e))
+            return problems
+
+        durations = {}
+
+        def export(p: str, out: JobOutput) -> typing.Iterable[str]:
+            start = time.perf_counter()
+            try:
+                fingerprint = ConanUtils.fingerprint(config, p)
+            except Exception as e:
+                out(f"Failed to fingerprint {p} due to the following error: {e}.")
+                fingerprint = None
+
+            if not args.force and fingerprint and record.exported(p, fingerprint):
+                out(f"Skipping {p}, nothing changed since the last export.")
+            else:
+                success, result = ConanUtils.export(config, p, out)
+                if not success:
+                    return [result]
+                if fingerprint:
+                    record.set(p, fingerprint, result)
+
+            durations[p] = time.perf_counter() - start
+            return []
+
+        # Projects in a wave only depend on projects in earlier waves, so they can be exported at the same time.
+        for i, wave in enumerate(waves):
+            print(f"Exporting wave {i + 1} of {len(waves)}: {', '.join(wave)}.")
+            problems.extend(run_jobs(wave, export, args.jobs))
+            if problems:
+                return problems
+
+        ExportCommand.report_critical_path(requires, durations)
 
         return problems
+
+    @staticmethod
+    def report_critical_path(requires: typing.Dict[str, typing.List[str]], durations: typing.Dict[str, float]) -> None:
+        """Print the chain of dependent exports that took the longest in total. Exporting can never be faster than
+        this chain, no matter how many jobs are used.
+        """
+        longest = {}
+        for wave in topological_waves(requires):
+            for p in wave:
+                prev = max(requires[p], key=lambda q: longest[q][0], default=None)
+                total, path = longest[prev] if prev else (0.0, [])
+                longest[p] = (total + durations.get(p, 0.0), path + [p])
+
+        if not longest:
+            return
+        total, path = max(longest.values(), key=lambda v: v[0])
+        print(f"Critical path ({total:.2f} s): {' -> '.join(f'{p} ({durations.get(p, 0.0):.2f} s)' for p in path)}")
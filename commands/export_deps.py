@@ -1,26 +1,29 @@
 import argparse
+import configparser
 import os
 import re
 import subprocess
 import tempfile
 import typing
 
-from conan.api.conan_api import ConanAPI
-from conans.client.graph.graph_error import GraphMissingError
-from conans.errors import ConanException
-
-from utils import get_config, get_arg_project
+from conanutils import ConanBackend, ConanUtils, LockfileStore
+from gitutils import MirrorCache
+from tracing import span
+from utils import get_config, get_arg_project, get_project_url, run_jobs, topological_waves, JobOutput
 
 class ExportDepsCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("export-deps", help="Automatically resolves all required packages for a single project\
-                              and exports them to the local Conan cache.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("export-deps", help=help)
         p.add_argument("--project", dest="project", required=False, help="Project name. If not set, will try to derive\
                        current project from working directory.")
         p.add_argument("--profile", dest="profile", required=True, help="Name of profile. Can be a profile stored in\
                        the Conan cache, or in the current projects' buildtools/profiles folder. The latter takes\
                        precedence.")
+        p.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, default=8, help="Number of\
+                       dependencies that are cloned and exported at the same time. Defaults to 8.")
+        p.add_argument("--no-lockfile", dest="no_lockfile", action="store_true", help="Do not use or store a\
+                       lockfile for the project and profile.")
         p.set_defaults(func=ExportDepsCommand.run)
 
     @staticmethod
@@ -36,48 +39,167 @@ class ExportDepsCommand:
 
         # TODO: Use tag.
 
-        api = ConanAPI()
-        remotes = api.remotes.list()
+        return ExportDepsCommand.export_deps(config, project, args.profile, args.jobs, not args.no_lockfile)
+
+    @staticmethod
+    def export_deps(config: configparser.ConfigParser, project: str, profile: str, jobs: int = 8,
+                    use_lockfile: bool = True, log: typing.Callable[..., None] = print) -> typing.Iterable[str]:
+        """Resolve all dependencies of a single project and export the ones that are missing from the Conan cache.
+
+        Args:
+            config (configparser.ConfigParser): Config.
+            project (str): Project name.
+            profile (str): Profile name.
+            jobs (int): Number of dependencies that are cloned and exported at the same time.
+            use_lockfile (bool): Use and store a lockfile.
+            log (typing.Callable[..., None]): Log function.
+
+        Returns:
+            typing.Iterable[str]: List of problems.
+        """
+        problems = []
+
         source = os.path.join(config["default"]["projectdir"], project, "source")
         conanfile = os.path.join(source, "conanfile.py")
-        if not os.path.exists(os.path.join(source, "buildtools", "profiles", args.profile)):
-            profile = api.profiles.get_profile([args.profile])
-        else:
-            profile = api.profiles.get_profile([args.profile], cwd=os.path.join(source, "buildtools", "profiles"))
+        profile = ConanUtils.find_profile(source, profile)
 
         if not os.path.exists(conanfile):
             problems.append(f"Could not find {conanfile}.")
             return problems
-        
-        tmp = tempfile.TemporaryDirectory()
 
-        # Iteratively discover missing pacakges by trying to construct the dependency graph.
+        # A valid lockfile means that all dependencies were resolved before, and none of them were removed or exported
+        # again since.
+        store = LockfileStore(project, source, profile)
+        if use_lockfile and store.get():
+            log(f"Lockfile {store.path} is up to date, all dependencies are present.")
+            return problems
+
+        # The mirrors are evicted even if the export fails, so the size and age limits are always enforced.
+        mirrors = MirrorCache.from_config(config)
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                # Dependencies are checked out from persistent mirrors, which only go to the network for tags they have
+                # not seen before.
+                def clone(ref: str, log: typing.Callable[..., None] = log, repository: bool = False) -> str:
+                    name, _, _, channel = ConanUtils.split_reference(ref)
+                    dep_source = os.path.join(tmp, f"{name}-{channel}" + ("-clone" if repository else ""))
+                    if not os.path.exists(dep_source):
+                        mirrors.checkout(get_project_url(config, name), channel, dep_source, log, repository)
+                    return dep_source
+
+                # Discover missing packages one level at a time by scanning the conanfiles of the project and of the
+                # dependencies that were just cloned. All missing packages of a level are cloned at the same time.
+                requires = {}
+                sources = {}
+                seen = set()
+                level = ConanUtils.find_requirements(conanfile)
+                while level:
+                    missing = [r for r in level if r not in seen and ConanBackend.latest_revision(r) is None]
+                    seen.update(level)
+
+                    def clone_job(ref: str, out: JobOutput) -> typing.Iterable[str]:
+                        sources[ref] = clone(ref, out)
+                        return []
+
+                    problems.extend(run_jobs(missing, clone_job, jobs))
+                    if problems:
+                        return problems
+
+                    level = []
+                    for ref in missing:
+                        requires[ref] = ConanUtils.find_requirements(os.path.join(sources[ref], "conanfile.py"))
+                        level.extend(requires[ref])
+                    level = sorted(set(level))
+
+                # Export in waves. A package is exported once all packages it requires are, since exporting needs at
+                # least the python_requires to be present.
+                try:
+                    waves = topological_waves(requires)
+                except RuntimeError as e:
+                    problems.append(str(e))
+                    return problems
+
+                def export_job(ref: str, out: JobOutput) -> typing.Iterable[str]:
+                    try:
+                        ConanBackend.export(sources[ref], out)
+                    except Exception:
+                        if os.path.exists(os.path.join(sources[ref], ".git")):
+                            raise
+                        # The recipe may use git in a way its conanfile does not show, e.g. through a python_requires
+                        # base class, so the export is tried once more from a clone.
+                        out("Export failed without a repository, retrying from a clone.")
+                        sources[ref] = clone(ref, out, repository=True)
+                        ConanBackend.export(sources[ref], out)
+                    return []
+
+                for wave in waves:
+                    problems.extend(run_jobs(wave, export_job, jobs))
+                    if problems:
+                        return problems
+
+                problems.extend(ExportDepsCommand.verify(conanfile, profile, project, clone, log))
+
+                if not problems and use_lockfile:
+                    ConanBackend.create_lockfile(source, profile, store.path, log)
+                    store.update()
+            finally:
+                mirrors.evict(log)
+
+        return problems
+
+    @staticmethod
+    def verify(conanfile: str, profile: str, project: str,
+               clone: typing.Callable[[str], str], log: typing.Callable[..., None] = print) -> typing.Iterable[str]:
+        """Verify that all dependencies are available by constructing the dependency graph. Any package the scan could
+        not find (e.g. because its reference is computed by the recipe) is discovered iteratively as a fallback. That
+        requires the in-process Conan backend; otherwise `conan graph info` is only used to report failures.
+        """
+        problems = []
+
+        if not ConanBackend.in_process():
+            with span("graph load", project=project, conanfile=conanfile):
+                result = subprocess.run(["conan", "graph", "info", conanfile, f"-pr:h={profile}", f"-pr:b={profile}"],
+                                        stdout=subprocess.DEVNULL)
+            if result.returncode != 0:
+                problems.append(f"Failed to resolve dependencies of {project}.")
+            return problems
+
+        from conans.client.graph.graph_error import GraphMissingError
+        from conans.errors import ConanException
+
+        fallback = set()
+
+        def export_fallback(ref: str) -> bool:
+            if ref in fallback:
+                problems.append(f"Exporting {ref} did not resolve it.")
+                return False
+            fallback.add(ref)
+            ConanBackend.export(clone(ref), log)
+            return True
+
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            prof = api.profiles.get_profile([profile])
+
         while True:
             # Try to construct dependency graph.
             try:
-                deps_graph = api.graph.load_graph_consumer(conanfile, None, None,
-                                                           None, None,
-                                                           profile, profile, None,
-                                                           remotes, [], False, False)
+                with span("graph load", project=project, conanfile=conanfile):
+                    with ConanBackend.lock:
+                        deps_graph = api.graph.load_graph_consumer(conanfile, None, None,
+                                                                   None, None,
+                                                                   prof, prof, None,
+                                                                   ConanBackend.remotes, [], False, False)
             except ConanException as e:
                 # Special handling for the python_requires, since that throws an exception instead of giving a nice
                 # error.
                 pattern = re.compile(r"pyreq\/\d+\.\d+\.\d+@timzoet\/v\d+\.\d+\.\d+")
                 pyreq_tag = pattern.search(str(e))
-                if pyreq_tag:
-                    # Determine URL.
-                    if config.getboolean("default", "http"):
-                        url = "https://github.com/TimZoet/pyreq.git"
-                    else:
-                        url = "git@github.com:TimZoet/pyreq.git"
-
-                    # Clone repo and export.
-                    dep_source = os.path.join(tmp.name, "pyreq")
-                    subprocess.check_call(["git", "clone", url, "--depth", "1", "-b", pyreq_tag.group(0).split('/')[2],
-                                           dep_source])
-                    subprocess.check_call(["conan", "export", dep_source])
+                if pyreq_tag and export_fallback(pyreq_tag.group(0)):
                     continue
-                
+                if pyreq_tag:
+                    break
+
                 problems.append(f"Unexpected error when reading {conanfile}: {e}.")
                 break
 
@@ -87,20 +209,11 @@ class ExportDepsCommand:
 
             # Unexpected error or missing package from some other weirdo.
             if not isinstance(deps_graph.error, GraphMissingError) or deps_graph.error.require.ref.user != "timzoet":
-                print(f"Failed to resolve dependency for {project}.")
+                log(f"Failed to resolve dependency for {project}.")
                 problems.append(f"Failed to resolve dependency {deps_graph.error.require.ref.name}.")
                 break
 
-            # Determine URL.
-            if config.getboolean("default", "http"):
-                url = f"https://github.com/TimZoet/{deps_graph.error.require.ref.name}.git"
-            else:
-                url = f"git@github.com:TimZoet/{deps_graph.error.require.ref.name}.git"
-
-            # Clone repo and export.
-            dep_source = os.path.join(tmp.name, deps_graph.error.require.ref.name)
-            subprocess.check_call(["git", "clone", url, "--depth", "1", "--recurse-submodules", "-b",
-                                   deps_graph.error.require.ref.channel, dep_source])
-            subprocess.check_call(["conan", "export", dep_source])
+            if not export_fallback(str(deps_graph.error.require.ref)):
+                break
 
         return problems
@@ -0,0 +1,206 @@
+import argparse
+import configparser
+import json
+import os
+import threading
+import time
+import typing
+
+from commands.cmake_generate import CmakeGenerateCommand
+from commands.conan_install import ConanInstallCommand
+from commands.export_deps import ExportDepsCommand
+from conanutils import ConanUtils
+from gitutils import GitUtils, clone_strategies
+from tracing import span
+from utils import get_cache_dir, get_config, resolve_project, run_jobs, JobOutput
+
+# All stages, in the order they run for each project.
+stages = ["clone", "export-deps", "conan-install", "cmake-generate"]
+
+class PipelineState:
+    """Persistent record of the stages that completed for each project in a pipeline that did not finish. A project is
+    removed from the record once all of its stages succeeded.
+    """
+    lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.path = os.path.join(get_cache_dir("pipeline"), "state.json")
+        try:
+            with open(self.path, encoding="UTF8") as f:
+                self.projects = json.load(f)
+        except (OSError, ValueError):
+            self.projects = {}
+
+    def completed(self, project: str, key: typing.List[typing.Any]) -> typing.List[str]:
+        """Get the stages that completed for a project in an earlier run with the same options."""
+        with PipelineState.lock:
+            entry = self.projects.get(project)
+        return entry["done"] if entry and entry["key"] == key else []
+
+    def set(self, project: str, key: typing.List[typing.Any], done: typing.Optional[typing.List[str]]) -> None:
+        with PipelineState.lock:
+            if done is None:
+                self.projects.pop(project, None)
+            else:
+                self.projects[project] = {"key": key, "done": done}
+            with open(self.path, encoding="UTF8", mode="w") as f:
+                json.dump(self.projects, f, indent=4, sort_keys=True)
+
+class PipelineContext:
+    """Everything the stages of a pipeline share: the config, options and state are read once, and the Conan stages
+    take turns on a single lock, since they all write to the Conan cache.
+    """
+    def __init__(self, config: configparser.ConfigParser, args) -> None:
+        self.config = config
+        self.args = args
+        self.state = PipelineState()
+        self.conan_lock = threading.Lock()
+        self.results = {}
+
+    def key(self, tag: typing.Optional[str]) -> typing.List[typing.Any]:
+        """Options that affect the outcome of the stages of a project. A failed pipeline is only resumed when these
+        did not change.
+        """
+        a = self.args
+        return [tag, a.profile, a.build, a.output_folder, a.generator, a.strategy, a.no_lockfile]
+
+class PipelineCommand:
+    @staticmethod
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("pipeline", help=help)
+        p.add_argument("--project", "--projects", nargs="+", dest="projects", required=False, help="Project names,\
+                       optionally with a tag to clone, e.g. 'project/tag'. If not set, will try to derive current\
+                       project from working directory.")
+        p.add_argument("--profile", dest="profile", required=True, help="Name of profile. Can be a profile stored in\
+                       the Conan cache, or in the current projects' buildtools/profiles folder. The latter takes\
+                       precedence.")
+        p.add_argument("--build", nargs="*", dest="build", required=False, default=["missing:*"], help="List of\
+                       values passed on directly to the --build argument of the conan install command. Defaults to\
+                       'missing:*'.")
+        p.add_argument("--output-folder", "--of", "-of", dest="output_folder", required=False, default="build",
+                       help="Output folder of conan install and cmake generate. If relative, it is joined with the\
+                       current projects' root folder (i.e. next to the source folder).")
+        p.add_argument("--generator", "-G", dest="generator", required=False, help="CMake generator. Defaults to\
+                       Visual Studio 17 2022 on Windows and Ninja on Linux.")
+        p.add_argument("--strategy", dest="strategy", choices=clone_strategies, required=False, help="How repositories\
+                       are cloned. Overrides the strategy option in the clone section of the devtools.ini file, which\
+                       defaults to full.")
+        p.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, help="Number of projects that are set\
+                       up at the same time. Defaults to all of them.")
+        p.add_argument("--export-jobs", dest="export_jobs", type=int, required=False, default=8, help="Number of\
+                       dependencies that are cloned and exported at the same time. Defaults to 8.")
+        p.add_argument("--no-lockfile", dest="no_lockfile", action="store_true", help="Do not use or store a\
+                       lockfile for the project and profile.")
+        p.add_argument("--restart", dest="restart", action="store_true", help="Run all stages, instead of resuming\
+                       a failed pipeline from the stage that failed.")
+        p.set_defaults(func=PipelineCommand.run)
+
+    @staticmethod
+    def run(args) -> typing.Iterable[str]:
+        problems = []
+
+        projects = {}
+        for p in args.projects or [None]:
+            known, project, tag = resolve_project(p)
+            if not known:
+                problems.append(f"Unknown project {project}.")
+                return problems
+            projects[project] = tag
+
+        context = PipelineContext(get_config(), args)
+
+        def pipeline(project: str, out: JobOutput) -> typing.Iterable[str]:
+            return PipelineCommand.pipeline(context, project, projects[project], out)
+
+        # Each project goes through its stages in order, but different projects overlap: one project can be cloned
+        # or generated while another one is installing. A single project runs directly, without buffering its output.
+        start = time.perf_counter()
+        if len(projects) == 1:
+            problems.extend(pipeline(next(iter(projects)), print))
+        else:
+            problems.extend(run_jobs(list(projects), pipeline, args.jobs or len(projects)))
+
+        PipelineCommand.report(list(projects), context.results, time.perf_counter() - start)
+
+        return problems
+
+    @staticmethod
+    def pipeline(context: PipelineContext, project: str, tag: typing.Optional[str],
+                 log: typing.Callable[..., None] = print) -> typing.Iterable[str]:
+        """Run all stages for a single project, skipping the stages that completed in an earlier run that failed.
+
+        Args:
+            context (PipelineContext): Shared context.
+            project (str): Project name.
+            tag (typing.Optional[str]): Tag to clone, or None.
+            log (typing.Callable[..., None]): Log function.
+
+        Returns:
+            typing.Iterable[str]: List of problems.
+        """
+        config = context.config
+        args = context.args
+        source = os.path.join(config["default"]["projectdir"], project, "source")
+        key = context.key(tag)
+
+        done = [] if args.restart else context.state.completed(project, key)
+        if done:
+            log(f"Resuming {project} after {done[-1]}.")
+        context.results[project] = {s: ("skipped", None) for s in done}
+
+        for stage in stages:
+            if stage in done:
+                continue
+
+            log(f"Running {stage} for {project}.")
+            start = time.perf_counter()
+            try:
+                with span("pipeline stage", project=project, stage=stage):
+                    if stage == "clone":
+                        _, problems = GitUtils.open_or_clone_project(f"{project}/{tag}" if tag else project, source,
+                                                                     config, log, args.strategy)
+                    elif stage == "cmake-generate":
+                        problems = CmakeGenerateCommand.generate(config, project, args.output_folder,
+                                                                 args.generator, log=log)
+                    else:
+                        # Exports and installs write to the same Conan cache, so only one Conan stage runs at a time,
+                        # across all projects. Clones and generates of other projects still overlap with them.
+                        profile = ConanUtils.find_profile(source, args.profile)
+                        with context.conan_lock:
+                            # Time spent waiting for other projects does not count towards this stage.
+                            start = time.perf_counter()
+                            if stage == "export-deps":
+                                problems = ExportDepsCommand.export_deps(config, project, profile, args.export_jobs,
+                                                                         not args.no_lockfile, log)
+                            else:
+                                problems = ConanInstallCommand.install(config, project, profile, args.build,
+                                                                       args.output_folder, log, not args.no_lockfile)
+                    problems = list(problems)
+            except Exception as e:
+                problems = [f"Failed to run {stage} for {project}: {e}"]
+
+            context.results[project][stage] = ("failed" if problems else "ok", time.perf_counter() - start)
+            if problems:
+                context.state.set(project, key, done)
+                log(f"Stopped {project} at {stage}. Run the pipeline again to resume from there.")
+                return problems
+            done = done + [stage]
+            context.state.set(project, key, done)
+
+        context.state.set(project, key, None)
+        return []
+
+    @staticmethod
+    def report(projects: typing.List[str],
+               results: typing.Dict[str, typing.Dict[str, typing.Tuple[str, typing.Optional[float]]]],
+               duration: float) -> None:
+        print("")
+        width = max(len(p) for p in projects + ["project"])
+        print(f"{'project':<{width}}" + "".join(f"  {s:>16}" for s in stages))
+        for project in projects:
+            cells = []
+            for stage in stages:
+                result, seconds = results.get(project, {}).get(stage, ("-", None))
+                cells.append(f"{result} {seconds:.1f}s" if seconds is not None else result)
+            print(f"{project:<{width}}" + "".join(f"  {c:>16}" for c in cells))
+        print(f"Total time {duration:.1f}s.")
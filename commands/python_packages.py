@@ -1,21 +1,79 @@
 import argparse
+import hashlib
 import os
 import subprocess
 import sys
 import typing
 
+from conanutils import ConanBackend
+
+requirements = ["conan>=2.0.3", "Sphinx>=6.0", "pydata-sphinx-theme"]
+
 class PythonPackagesCommand:
     @staticmethod
-    def setup(parser: argparse.ArgumentParser):
-        p = parser.add_parser("python-packages", help="Installs required Python packages.")
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("python-packages", help=help)
         p.set_defaults(func=PythonPackagesCommand.run)
 
     @staticmethod
     def run(args) -> typing.Iterable[str]:
-        pkg = ["conan>=2.0.3", "Sphinx>=6.0", "pydata-sphinx-theme", "gitpython>=3.1"]
-        for p in pkg:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", p])
+        problems = []
+
+        # Only start pip when something is missing, and then install everything in one go.
+        missing = PythonPackagesCommand.find_missing(requirements)
+        if missing:
+            print(f"Installing {', '.join(missing)}.")
+            subprocess.check_call([sys.executable, "-m", "pip", "install", *missing])
+        else:
+            print("All required Python packages are installed.")
 
         # Install base Conan profiles.
-        subprocess.check_call(["conan", "config", "install", "-t", "dir", "-sf", "profiles", "-tf", "profiles", 
-                               os.path.join(os.path.dirname(__file__), "conan-config", "profiles")])
+        config = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "conan-config")
+        if PythonPackagesCommand.profiles_installed(os.path.join(config, "profiles")):
+            print("All base Conan profiles are installed.")
+        else:
+            subprocess.check_call(["conan", "config", "install", "-t", "dir", "-sf", "profiles", "-tf", "profiles",
+                                   config])
+
+        return problems
+
+    @staticmethod
+    def find_missing(reqs: typing.List[str]) -> typing.List[str]:
+        """Find the requirements that are not installed, or installed with a version that does not match.
+
+        Args:
+            reqs (typing.List[str]): Requirement specifiers, e.g. conan>=2.0.3.
+
+        Returns:
+            typing.List[str]: Requirements that need to be installed.
+        """
+        import importlib.metadata
+        try:
+            from packaging.requirements import Requirement
+        except ImportError:
+            from pip._vendor.packaging.requirements import Requirement
+
+        missing = []
+        for r in reqs:
+            req = Requirement(r)
+            try:
+                version = importlib.metadata.version(req.name)
+            except importlib.metadata.PackageNotFoundError:
+                missing.append(r)
+                continue
+            if not req.specifier.contains(version, prereleases=True):
+                missing.append(r)
+        return missing
+
+    @staticmethod
+    def profiles_installed(folder: str) -> bool:
+        """Check if all profiles in a folder are installed in the Conan home folder with the same contents."""
+        target = os.path.join(ConanBackend.home(), "profiles")
+        for name in os.listdir(folder):
+            installed = os.path.join(target, name)
+            if not os.path.isfile(installed):
+                return False
+            with open(os.path.join(folder, name), "rb") as a, open(installed, "rb") as b:
+                if hashlib.sha256(a.read()).digest() != hashlib.sha256(b.read()).digest():
+                    return False
+        return True
@@ -0,0 +1,56 @@
+import argparse
+import typing
+
+from conanutils import ExportRecord, WorkspaceIndex
+from utils import known_projects, filter_known_projects, get_config, run_jobs, JobOutput
+
+class StatusCommand:
+    @staticmethod
+    def setup(parser: argparse.ArgumentParser, help: str):
+        p = parser.add_parser("status", help=help)
+        p.add_argument("--projects", nargs="*", required=False, help="List of projects to show. If empty, all known\
+                       projects are shown.")
+        p.add_argument("--refresh", dest="refresh", action="store_true", help="Check all projects again, instead of\
+                       reusing the stored state of projects whose HEAD and git index did not change.")
+        p.add_argument("--jobs", "-j", dest="jobs", type=int, required=False, help="Number of projects that are\
+                       checked at the same time. Defaults to all of them.")
+        p.set_defaults(func=StatusCommand.run)
+
+    @staticmethod
+    def run(args) -> typing.Iterable[str]:
+        if args.projects:
+            projects = filter_known_projects(p.split("/")[0] for p in args.projects)
+        else:
+            projects = known_projects
+
+        config = get_config()
+        record = ExportRecord()
+        index = WorkspaceIndex()
+        states = {}
+
+        def check(p: str, out: JobOutput) -> typing.Iterable[str]:
+            states[p] = index.get(config, p, record, args.refresh)
+            return []
+
+        problems = run_jobs(projects, check, args.jobs or len(projects))
+        index.save()
+
+        StatusCommand.report(projects, states)
+
+        return problems
+
+    @staticmethod
+    def report(projects: typing.List[str], states: typing.Dict[str, typing.Dict[str, typing.Any]]) -> None:
+        width = max(len(p) for p in projects + ["project"])
+        print(f"{'project':<{width}}  {'ref':<24}  {'commit':<10}  {'changes':<9}  exported")
+        for p in projects:
+            state = states.get(p)
+            if state is None:
+                print(f"{p:<{width}}  failed")
+            elif not state["cloned"]:
+                print(f"{p:<{width}}  not cloned")
+            else:
+                ref = state["tag"] or state["branch"] or "detached"
+                commit = state["commit"][:10] if state["commit"] else "-"
+                print(f"{p:<{width}}  {ref:<24}  {commit:<10}  {'dirty' if state['dirty'] else 'clean':<9}"
+                      f"  {'yes' if state['exported'] else 'no'}")
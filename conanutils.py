@@ -1,54 +1,633 @@
+import ast
 import configparser
+import hashlib
+import importlib.util
+import json
 import os
+import re
 import subprocess
+import tempfile
+import threading
 import typing
 
-import git
+from gitutils import GitUtils, MirrorCache, Repository
+from tracing import traced
+from utils import get_cache_dir, get_config, check_call_logged
 
-from gitutils import RestorableCommit
+# Matches references to packages of known projects, e.g. common/1.0.0@timzoet/v1.0.0.
+requirement_pattern = re.compile(r"[a-z0-9_\-]+\/[a-zA-Z0-9_\.\-\+]+@timzoet\/[a-zA-Z0-9_\.\-\+]+")
+
+# Class attributes and methods of a recipe through which it declares its requirements.
+requirement_names = ["requires", "python_requires", "build_requires", "tool_requires", "test_requires"]
+
+class ConanBackend:
+    """Shared access to Conan for all commands. By default Conan runs in-process through a single ConanAPI instance,
+    which avoids paying for interpreter and Conan startup on every call. The conan CLI is used instead when Conan
+    cannot be imported, or when the backend is set to subprocess through the DEVTOOLS_CONAN_BACKEND environment
+    variable or the backend option in the conan section of the devtools.ini file.
+
+    ConanAPI is not thread-safe, so all in-process calls are serialized.
+    """
+    api = None
+    remotes = None
+    mode = None
+    # Config and Conan environment variables the mode and API were set up with. The daemon runs each command with the
+    # environment of its client, so they are set up again when these change.
+    context = None
+    lock = threading.RLock()
+
+    @staticmethod
+    def refresh() -> None:
+        """Forget the mode and API when the config or the environment variables they depend on changed."""
+        config = get_config()
+        env = sorted((k, v) for k, v in os.environ.items() if k.startswith(("CONAN_", "DEVTOOLS_CONAN_")))
+        with ConanBackend.lock:
+            if ConanBackend.context is None or ConanBackend.context[0] is not config or ConanBackend.context[1] != env:
+                ConanBackend.api = None
+                ConanBackend.remotes = None
+                ConanBackend.mode = None
+                ConanBackend.context = (config, env)
+
+    @staticmethod
+    def in_process() -> bool:
+        ConanBackend.refresh()
+        if ConanBackend.mode is None:
+            mode = os.getenv("DEVTOOLS_CONAN_BACKEND") or get_config().get("conan", "backend", fallback="api")
+            if mode == "api" and importlib.util.find_spec("conan") is None:
+                mode = "subprocess"
+            ConanBackend.mode = mode
+        return ConanBackend.mode == "api"
+
+    @staticmethod
+    def home() -> str:
+        return os.getenv("CONAN_HOME") or os.path.join(os.path.expanduser("~"), ".conan2")
+
+    @staticmethod
+    def cache_stamp() -> typing.Optional[int]:
+        """Get the modification time of the database of the Conan cache, which changes whenever packages are added to
+        or removed from the cache.
+        """
+        path = os.path.join(ConanBackend.home(), "p", "cache.sqlite3")
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+    @staticmethod
+    def get_api():
+        with ConanBackend.lock:
+            ConanBackend.refresh()
+            if ConanBackend.api is None:
+                from conan.api.conan_api import ConanAPI
+                ConanBackend.api = ConanAPI()
+                ConanBackend.remotes = ConanBackend.api.remotes.list()
+            return ConanBackend.api
+
+    @staticmethod
+    @traced("conan export")
+    def export(path: str, log: typing.Callable[..., None] = print) -> str:
+        """Export a recipe to the local Conan cache.
+
+        Args:
+            path (str): Folder containing the conanfile.
+            log (typing.Callable[..., None]): Log function.
+
+        Returns:
+            str: Exported reference, including revision.
+        """
+        if not ConanBackend.in_process():
+            # The reference is written to stdout, everything else to stderr.
+            result = subprocess.run(["conan", "export", path, "--format=json"], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True)
+            if result.stderr:
+                log(result.stderr, end="" if result.stderr.endswith("\n") else "\n")
+            if result.returncode != 0:
+                raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+            return json.loads(result.stdout)["reference"]
+
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            ref, _ = api.export.export(os.path.join(path, "conanfile.py"), None, None, None, None,
+                                       remotes=ConanBackend.remotes)
+            log(f"Exported {ref.repr_notime()}.")
+            return ref.repr_notime()
+
+    @staticmethod
+    @traced("conan list")
+    def list_recipes(pattern: str, unused_days: typing.Optional[int] = None) -> typing.List[typing.Tuple[str, float]]:
+        """List all recipe revisions in the local Conan cache that match a pattern.
+
+        Args:
+            pattern (str): Reference pattern without revision, e.g. common/*.
+            unused_days (typing.Optional[int]): Only list recipe revisions that were not used for this many days.
+
+        Returns:
+            typing.List[typing.Tuple[str, float]]: Reference with revision and timestamp of each recipe revision.
+        """
+        lru = f"{unused_days}d" if unused_days is not None else None
+        if not ConanBackend.in_process():
+            result = subprocess.run(["conan", "list", f"{pattern}#*", "--format=json",
+                                     *([f"--lru={lru}"] if lru else [])], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True, check=True)
+            recipes = json.loads(result.stdout).get("Local Cache", {})
+            return [(f"{ref}#{rev}", info.get("timestamp", 0)) for ref, bundle in recipes.items()
+                    if isinstance(bundle, dict) for rev, info in bundle.get("revisions", {}).items()]
+
+        from conan.api.model import ListPattern
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            selected = api.list.select(ListPattern(pattern, rrev="*"), lru=lru)
+            return [(ref.repr_notime(), ref.timestamp or 0) for ref in selected.refs()]
+
+    @staticmethod
+    def recipe_sizes(refs: typing.List[str]) -> typing.Optional[typing.Dict[str, int]]:
+        """Get how much disk space recipe revisions take up in the local Conan cache, including all of their binaries
+        and build folders.
+
+        Args:
+            refs (typing.List[str]): References with revision.
+
+        Returns:
+            typing.Optional[typing.Dict[str, int]]: Size in bytes of each recipe revision, or None if the sizes are
+            unknown because Conan does not run in-process.
+        """
+        if not ConanBackend.in_process():
+            return None
+
+        from conan.api.model import ListPattern
+        from conans.model.recipe_ref import RecipeReference
+
+        def folder_size(path: str) -> int:
+            return sum(os.path.getsize(os.path.join(r, f)) for r, _, files in os.walk(path) for f in files)
+
+        sizes = {}
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            for r in refs:
+                # The export folder and package folders sit inside of the folder of the recipe or package, next to
+                # their sources and builds.
+                folders = [os.path.dirname(api.cache.export_path(RecipeReference.loads(r)))]
+                packages = api.list.select(ListPattern(f"{r}:*#*"))
+                for ref, bundle in packages.refs().items():
+                    folders.extend(os.path.dirname(api.cache.package_path(pref))
+                                   for pref in packages.prefs(ref, bundle))
+                sizes[r] = sum(folder_size(f) for f in folders)
+        return sizes
+
+    @staticmethod
+    @traced("conan remove")
+    def remove(refs: typing.List[str], log: typing.Callable[..., None] = print) -> None:
+        """Remove recipe revisions and all of their binaries from the local Conan cache, in a single pass.
+
+        Args:
+            refs (typing.List[str]): References with revision, e.g. common/1.0.0@timzoet/v1.0.0#<revision>.
+            log (typing.Callable[..., None]): Log function.
+        """
+        if not refs:
+            return
+
+        if not ConanBackend.in_process():
+            # A package list removes everything with one conan process, instead of one for each pattern.
+            recipes = {}
+            for r in refs:
+                ref, _, revision = r.partition("#")
+                recipes.setdefault(ref, {"revisions": {}})["revisions"][revision] = {}
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "remove.json")
+                with open(path, encoding="UTF8", mode="w") as f:
+                    json.dump({"Local Cache": recipes}, f)
+                check_call_logged(["conan", "remove", "-c", f"--list={path}"], log)
+            return
+
+        from conans.model.recipe_ref import RecipeReference
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            for r in refs:
+                log(f"Removing {r}.")
+                api.remove.recipe(RecipeReference.loads(r))
+
+    @staticmethod
+    @traced("conan install")
+    def install(source: str, profile: str, build: typing.List[str], output_folder: str,
+                log: typing.Callable[..., None] = print, lockfile: typing.Optional[str] = None,
+                lockfile_out: typing.Optional[str] = None) -> None:
+        """Install all dependencies of a conanfile and run its generators, like the `conan install` command. Installs
+        download and build packages in the Conan cache, which is not safe to do from several processes at once, so
+        they run one at a time, also when Conan runs in a separate process.
+
+        Args:
+            source (str): Folder containing the conanfile.
+            profile (str): Profile name or path, used for both the host and build context.
+            build (typing.List[str]): Values for the --build argument.
+            output_folder (str): Output folder for generated files.
+            log (typing.Callable[..., None]): Log function.
+            lockfile (typing.Optional[str]): Lockfile that constrains the dependency graph.
+            lockfile_out (typing.Optional[str]): Path to write the resulting lockfile to.
+        """
+        if not ConanBackend.in_process():
+            with ConanBackend.lock:
+                check_call_logged(["conan", "install", f"-pr:h={profile}", f"-pr:b={profile}",
+                                   *(f"--build={b}" for b in build), f"-of={output_folder}",
+                                   *([f"--lockfile={lockfile}"] if lockfile else []),
+                                   *([f"--lockfile-out={lockfile_out}"] if lockfile_out else []), source], log)
+            return
+
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            remotes = ConanBackend.remotes
+            conanfile = os.path.join(source, "conanfile.py")
+            prof = api.profiles.get_profile([profile])
+            lock = api.lockfile.get_lockfile(lockfile=lockfile, conanfile_path=conanfile)
+            deps_graph = api.graph.load_graph_consumer(conanfile, None, None, None, None, prof, prof, lock, remotes,
+                                                       None)
+            deps_graph.report_graph_error()
+            api.graph.analyze_binaries(deps_graph, build, remotes, lockfile=lock)
+            api.install.install_binaries(deps_graph=deps_graph, remotes=remotes)
+            api.install.install_consumer(deps_graph, None, source, output_folder)
+            if lockfile_out:
+                api.lockfile.save_lockfile(api.lockfile.update_lockfile(lock, deps_graph), lockfile_out)
+            log(f"Installed {source} to {output_folder}.")
+
+    @staticmethod
+    @traced("lock create")
+    def create_lockfile(source: str, profile: str, lockfile_out: str, log: typing.Callable[..., None] = print) -> None:
+        """Resolve the dependency graph of a conanfile and write it to a lockfile, like the `conan lock create` command.
+
+        Args:
+            source (str): Folder containing the conanfile.
+            profile (str): Profile name or path, used for both the host and build context.
+            lockfile_out (str): Path to write the lockfile to.
+            log (typing.Callable[..., None]): Log function.
+        """
+        if not ConanBackend.in_process():
+            check_call_logged(["conan", "lock", "create", f"-pr:h={profile}", f"-pr:b={profile}",
+                               f"--lockfile-out={lockfile_out}", source], log)
+            return
+
+        with ConanBackend.lock:
+            api = ConanBackend.get_api()
+            conanfile = os.path.join(source, "conanfile.py")
+            prof = api.profiles.get_profile([profile])
+            deps_graph = api.graph.load_graph_consumer(conanfile, None, None, None, None, prof, prof, None,
+                                                       ConanBackend.remotes, None)
+            deps_graph.report_graph_error()
+            api.lockfile.save_lockfile(api.lockfile.update_lockfile(None, deps_graph), lockfile_out)
+
+    @staticmethod
+    @traced("revision lookup")
+    def latest_revision(ref: str) -> typing.Optional[str]:
+        """Get the latest recipe revision of a reference in the local Conan cache.
+
+        Args:
+            ref (str): Reference without revision, e.g. common/1.0.0@timzoet/v1.0.0.
+
+        Returns:
+            typing.Optional[str]: Revision, or None if the recipe is not in the cache.
+        """
+        if not ConanBackend.in_process():
+            result = subprocess.run(["conan", "list", f"{ref}#latest", "--format=json"], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True)
+            if result.returncode != 0:
+                return None
+            recipes = json.loads(result.stdout).get("Local Cache", {})
+            revisions = recipes.get(ref, {}).get("revisions", {}) if isinstance(recipes.get(ref), dict) else {}
+            return next(iter(revisions), None)
+
+        from conans.errors import ConanException
+        from conans.model.recipe_ref import RecipeReference
+        with ConanBackend.lock:
+            try:
+                latest = ConanBackend.get_api().list.latest_recipe_revision(RecipeReference.loads(ref))
+            except ConanException:
+                latest = None
+            return latest.revision if latest else None
+
+class LockfileStore:
+    """Stored lockfile for a project and profile. A lockfile is valid as long as the conanfile and profile did not
+    change, and all packages of known projects it locks still have the same latest revision in the Conan cache.
+    """
+    def __init__(self, project: str, source: str, profile: str) -> None:
+        name = re.sub(r"[^a-zA-Z0-9_\-\.]", "_", profile)
+        folder = get_cache_dir("lockfiles", project)
+        self.path = os.path.join(folder, f"{name}.lock")
+        self.meta_path = os.path.join(folder, f"{name}.json")
+        self.conanfile = os.path.join(source, "conanfile.py")
+        self.profile = profile
+
+    def inputs(self) -> str:
+        h = hashlib.sha256()
+        h.update(self.profile.encode())
+        profile = self.profile if os.path.isfile(self.profile) else os.path.join(ConanBackend.home(), "profiles",
+                                                                                 self.profile)
+        for path in [self.conanfile, profile]:
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    def get(self) -> typing.Optional[str]:
+        """Get the path to the lockfile, if there is a valid one.
+
+        Returns:
+            typing.Optional[str]: Path to lockfile, or None.
+        """
+        try:
+            with open(self.meta_path, encoding="UTF8") as f:
+                meta = json.load(f)
+            with open(self.path, encoding="UTF8") as f:
+                locked = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("inputs") != self.inputs():
+            return None
+
+        # Any package of a known project that was exported again invalidates the lockfile.
+        for section in ["requires", "build_requires", "python_requires"]:
+            for entry in locked.get(section, []):
+                ref, _, rrev = entry.partition("#")
+                if "@timzoet/" in ref and ConanBackend.latest_revision(ref) != rrev.split("%")[0]:
+                    return None
+
+        return self.path
+
+    def update(self) -> None:
+        """Record the inputs of the lockfile after it was (re)written."""
+        with open(self.meta_path, encoding="UTF8", mode="w") as f:
+            json.dump({"inputs": self.inputs()}, f)
+
+class ExportRecord:
+    """Persistent record of the last successful export of each project (and branch/tag): the fingerprint of its inputs
+    and the recipe revision it produced.
+    """
+    lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.path = os.path.join(get_cache_dir("export"), "fingerprints.json")
+        try:
+            with open(self.path, encoding="UTF8") as f:
+                self.fingerprints = json.load(f)
+        except (OSError, ValueError):
+            self.fingerprints = {}
+
+    def get(self, project: str) -> typing.Optional[str]:
+        entry = self.fingerprints.get(project)
+        return entry[0] if isinstance(entry, list) else entry
+
+    def reference(self, project: str) -> typing.Optional[str]:
+        """Get the reference, including revision, that the last export of a project produced."""
+        entry = self.fingerprints.get(project)
+        return entry[1] if isinstance(entry, list) else None
+
+    def exported(self, project: str, fingerprint: str) -> bool:
+        """Check if a project was exported with the same fingerprint, and the revision that produced is still the
+        latest one in the Conan cache. The cache can change outside of devtools, e.g. through conan remove.
+        """
+        reference = self.reference(project)
+        if self.get(project) != fingerprint or not reference:
+            return False
+        ref, _, revision = reference.partition("#")
+        return ConanBackend.latest_revision(ref) == revision
+
+    def set(self, project: str, fingerprint: str, reference: str) -> None:
+        with ExportRecord.lock:
+            self.fingerprints[project] = [fingerprint, reference]
+            with open(self.path, encoding="UTF8", mode="w") as f:
+                json.dump(self.fingerprints, f, indent=4, sort_keys=True)
+
+    def forget(self, projects: typing.Iterable[str]) -> None:
+        """Drop the fingerprints of all branches/tags of some projects, e.g. after their packages were removed."""
+        names = set(projects)
+        with ExportRecord.lock:
+            self.fingerprints = {k: v for k, v in self.fingerprints.items() if k.split("/")[0] not in names}
+            with open(self.path, encoding="UTF8", mode="w") as f:
+                json.dump(self.fingerprints, f, indent=4, sort_keys=True)
+
+class WorkspaceIndex:
+    """Persistent index of the state of each project: its branch or tag, whether it has uncommitted changes and whether
+    it was exported in its current state. An entry is reused as long as HEAD, the git index, the changed files (and
+    their modification times), the last export of the project and the Conan cache database are the same. Checking
+    those takes a single git status, while computing the state also requires fingerprinting the working tree and
+    looking up the exported revision in the Conan cache.
+    """
+    lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.path = os.path.join(get_cache_dir("status"), "index.json")
+        try:
+            with open(self.path, encoding="UTF8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, config: configparser.ConfigParser, project: str, record: ExportRecord,
+            refresh: bool = False) -> typing.Dict[str, typing.Any]:
+        """Get the state of a project, computing it only if it changed since it was last stored.
+
+        Args:
+            config (configparser.ConfigParser): Config.
+            project (str): Project name.
+            record (ExportRecord): Last exports.
+            refresh (bool): Always compute the state.
+
+        Returns:
+            typing.Dict[str, typing.Any]: State with the keys cloned, commit, branch, tag, dirty and exported.
+        """
+        source = os.path.join(config["default"]["projectdir"], project, "source")
+        if not os.path.exists(os.path.join(source, ".git")):
+            return {"cloned": False}
+
+        git_dir, commit, branch = GitUtils.head(source)
+        changes = subprocess.check_output(["git", "-C", source, "status", "--porcelain", "-z",
+                                           "--untracked-files=all"], text=True)
+        index = os.path.join(git_dir, "index")
+
+        # Entries for renames and copies are followed by an extra field with the original path, which is skipped.
+        entries = []
+        fields = iter(changes.split("\0"))
+        for entry in fields:
+            if entry:
+                entries.append(entry)
+                if "R" in entry[:2] or "C" in entry[:2]:
+                    next(fields, None)
+
+        h = hashlib.sha256(changes.encode())
+        for entry in entries:
+            path = os.path.join(source, entry[3:])
+            if os.path.exists(path):
+                h.update(str(os.stat(path).st_mtime_ns).encode())
+        key = [commit, branch, os.stat(index).st_mtime_ns if os.path.exists(index) else None, h.hexdigest(),
+               record.get(project), record.reference(project), ConanBackend.cache_stamp()]
+
+        with WorkspaceIndex.lock:
+            entry = self.entries.get(project)
+        if not refresh and entry and entry["key"] == key:
+            return entry["state"]
+
+        tags = Repository.open(source).tags_at(commit) if commit else []
+        state = {
+            "cloned": True,
+            "commit": commit,
+            "branch": branch[len("refs/heads/"):] if branch and branch.startswith("refs/heads/") else branch,
+            "tag": tags[0] if tags else None,
+            "dirty": any(not e.startswith("??") for e in entries),
+            "exported": commit is not None and record.exported(project, ConanUtils.fingerprint(config, project))
+        }
+
+        # Fingerprinting may have refreshed the git index, so its modification time is read again.
+        key[2] = os.stat(index).st_mtime_ns if os.path.exists(index) else None
+        with WorkspaceIndex.lock:
+            self.entries[project] = {"key": key, "state": state}
+        return state
+
+    def save(self) -> None:
+        with WorkspaceIndex.lock:
+            with open(self.path, encoding="UTF8", mode="w") as f:
+                json.dump(self.entries, f, indent=4, sort_keys=True)
 
 class ConanUtils:
     @staticmethod
-    def export(config: configparser.ConfigParser, project: str) -> typing.Tuple[bool, typing.Optional[str]]:
+    def split_reference(ref: str) -> typing.Tuple[str, str, str, str]:
+        """Split a full reference into name, version, user and channel."""
+        name_version, user_channel = ref.split("@")
+        name, version = name_version.split("/")
+        user, channel = user_channel.split("/")
+        return name, version, user, channel
+
+    @staticmethod
+    def find_profile(source: str, profile: str) -> str:
+        """Resolve a profile name. A profile in the buildtools/profiles folder of the project takes precedence over a
+        profile stored in the Conan cache.
+
+        Args:
+            source (str): Project source folder.
+            profile (str): Profile name.
+
+        Returns:
+            str: Path to the project profile, or the unchanged profile name.
+        """
+        path = os.path.join(source, "buildtools", "profiles", profile)
+        return path if os.path.exists(path) else profile
+
+    @staticmethod
+    @traced("fingerprint")
+    def fingerprint(config: configparser.ConfigParser, project: str) -> str:
+        """Compute a fingerprint of everything that goes into the export of a project: the git tree of the exported
+        files and the contents of the conanfile.
+
+        Args:
+            config (configparser.ConfigParser): Config.
+            project (str): Project name and optional branch/tag.
+
+        Returns:
+            str: Fingerprint.
+        """
+        tag = None
+        if "/" in project:
+            project, tag = project.split("/")
+
+        source = os.path.join(config["default"]["projectdir"], project, "source")
+        if tag:
+            conanfile = Repository.open(source).read_file(tag, "conanfile.py")
+            if conanfile is None:
+                raise RuntimeError(f"There is no conanfile.py in {tag} of {source}.")
+        else:
+            with open(os.path.join(source, "conanfile.py"), "rb") as f:
+                conanfile = f.read()
+
+        h = hashlib.sha256(GitUtils.tree_hash(source, tag).encode())
+        h.update(conanfile)
+        return h.hexdigest()
+
+    @staticmethod
+    def find_requirements(conanfile: str, ref: typing.Optional[str] = None) -> typing.List[str]:
+        """Statically scan a conanfile for references to packages of known projects. This finds regular requires as
+        well as python_requires, without having to load the recipe through Conan. Only literal references assigned to
+        one of the requirement attributes or passed to one of the requirement methods count, so references in
+        comments, docstrings or other strings do not.
+
+        Args:
+            conanfile (str): Path to conanfile.
+            ref (typing.Optional[str]): Read the conanfile as it is in this branch/tag of its repository instead of
+            from the working tree.
+
+        Returns:
+            typing.List[str]: Sorted list of unique references.
+        """
+        if ref:
+            content = Repository.open(os.path.dirname(conanfile)).read_file(ref, "conanfile.py")
+            if content is None:
+                raise RuntimeError(f"There is no conanfile.py in {ref} of {os.path.dirname(conanfile)}.")
+            text = content.decode()
+        else:
+            with open(conanfile, encoding="UTF8") as f:
+                text = f.read()
+
+        try:
+            tree = ast.parse(text)
+        except SyntaxError:
+            # Conan will report the actual error, just skip comments.
+            lines = (line for line in text.splitlines() if not line.lstrip().startswith("#"))
+            return sorted(set(requirement_pattern.findall("\n".join(lines))))
+
+        values = []
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                if node.value and any(isinstance(t, ast.Name) and t.id in requirement_names for t in targets):
+                    values.append(node.value)
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and \
+                    node.func.attr in requirement_names and node.args:
+                values.append(node.args[0])
+
+        refs = set()
+        for value in values:
+            # A single reference, or a list or tuple of them.
+            for n in value.elts if isinstance(value, (ast.List, ast.Tuple)) else [value]:
+                if isinstance(n, ast.Constant) and isinstance(n.value, str) and requirement_pattern.fullmatch(n.value):
+                    refs.add(n.value)
+        return sorted(refs)
+
+    @staticmethod
+    def export(config: configparser.ConfigParser, project: str,
+               log: typing.Callable[..., None] = print) -> typing.Tuple[bool, typing.Optional[str]]:
         """Export a project to the local Conan cache. By default the current state of the repository is exported. When a
-        branch/tag is specified, an attempt is made to perform a checkout before doing the export. The repository is
-        restored to its original state afterwards.
+        branch/tag is specified, a snapshot of that branch/tag is written to a temporary folder and exported from
+        there. The working tree of the repository is never touched, so several tags can be exported at the same time.
 
         Args:
             config (configparser.ConfigParser): Config.
             project (str): Project name and optional branch/tag to export.
+            log (typing.Callable[..., None]): Log function.
 
         Returns:
-            typing.Tuple[bool, typing.Optional[str]]: Boolean indicating success and an optional error message on
-            failure.
+            typing.Tuple[bool, str]: Boolean indicating success, and the exported reference (including revision) on
+            success or an error message on failure.
         """
-        # TODO: Introduce an option to stash and restore changes that might prevent a checkout.
-        
         tag = None
         if "/" in project:
             project, tag = project.split("/")
 
         source = os.path.join(config["default"]["projectdir"], project, "source")
-        try:
-            repo = git.Repo(source)
-            commit = RestorableCommit(repo)
-        except Exception as e:
-            print(f"Failed to open repository due to the following error: {e}.")
+        if not os.path.exists(os.path.join(source, ".git")):
             return False, f"Failed to open repository {project} at {source}."
 
-        if tag:
-            print(f"Checking out {tag}.")
+        if not tag:
+            return True, ConanBackend.export(source, log)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot = os.path.join(tmp, "snapshot")
             try:
-                repo.git.checkout(tag)
+                GitUtils.snapshot(source, tag, snapshot, MirrorCache.from_config(config), log)
             except Exception as e:
-                print(f"Failed to check out specific branch due to the following error: {e}.")
-                return False, f"Failed to checkout branch {tag} at {source}. Export of {project} did not succeed."
-        
-        try:
-            subprocess.check_call(["conan", "export", source])
-        finally:
-            commit.restore()
+                log(f"Failed to write snapshot due to the following error: {e}.")
+                return False, f"Failed to check out branch {tag} at {source}. Export of {project} did not succeed."
 
-        del commit
-        del repo
-        return True, None
\ No newline at end of file
+            try:
+                return True, ConanBackend.export(snapshot, log)
+            except Exception:
+                if os.path.exists(os.path.join(snapshot, ".git")):
+                    raise
+                # The recipe may use git in a way its conanfile does not show, e.g. through a python_requires base
+                # class, so the export is tried once more from a clone.
+                log("Export failed without a repository, retrying from a clone.")
+                snapshot = os.path.join(tmp, "clone")
+                GitUtils.snapshot(source, tag, snapshot, MirrorCache.from_config(config), log, clone=True)
+                return True, ConanBackend.export(snapshot, log)
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+import typing
+
+from utils import get_cache_dir
+
+# Size of the header that precedes every message: the length of the JSON payload.
+header = struct.Struct("!Q")
+
+# Credentials of the other end of a connection, as returned for SO_PEERCRED: process, user and group id.
+credentials = struct.Struct("3i")
+
+def get_socket_name() -> str:
+    """Get the file name of the socket of the daemon. There is a separate daemon for each root directory and Conan home
+    folder, since those determine the state it keeps warm.
+    """
+    key = hashlib.sha256(f"{os.getenv('DEVTOOLS_ROOT_DIR')}\0{os.getenv('CONAN_HOME', '')}".encode()).hexdigest()
+    return f"devtools-{key[:12]}.sock"
+
+def get_folder_record() -> str:
+    """Get the path of the file that records the private folder the daemon created for its socket, when the user has
+    no runtime directory.
+    """
+    return os.path.join(get_cache_dir("daemon"), get_socket_name() + ".folder")
+
+def get_socket_path() -> typing.Optional[str]:
+    """Get the path of the socket of the daemon. It is placed in a folder only the user can access: the runtime
+    directory of the user, or else a private temporary folder created by the daemon.
+
+    Returns:
+        typing.Optional[str]: Path, or None if no daemon recorded its folder.
+    """
+    if os.getenv("XDG_RUNTIME_DIR"):
+        return os.path.join(os.getenv("XDG_RUNTIME_DIR"), get_socket_name())
+    try:
+        with open(get_folder_record(), encoding="UTF8") as f:
+            return os.path.join(f.read(), get_socket_name())
+    except OSError:
+        return None
+
+def get_peer(sock: socket.socket) -> typing.Tuple[int, int]:
+    """Get the process and user id of the other end of a connection."""
+    pid, uid, _ = credentials.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+    return pid, uid
+
+def send(sock: socket.socket, message: dict, fds: typing.Optional[typing.List[int]] = None) -> None:
+    payload = json.dumps(message).encode()
+    socket.send_fds(sock, [header.pack(len(payload))], fds or [])
+    sock.sendall(payload)
+
+def receive(sock: socket.socket) -> typing.Tuple[typing.Optional[dict], typing.List[int]]:
+    data, fds, _, _ = socket.recv_fds(sock, header.size, 3)
+    if len(data) < header.size:
+        return None, fds
+    size, = header.unpack(data)
+    payload = b""
+    while len(payload) < size:
+        chunk = sock.recv(size - len(payload))
+        if not chunk:
+            return None, fds
+        payload += chunk
+    return json.loads(payload), fds
+
+def connect() -> typing.Optional[socket.socket]:
+    """Connect to the daemon. The daemon is only used when it runs as the same user, since it gets the environment and
+    console of the client.
+
+    Returns:
+        typing.Optional[socket.socket]: Connection, or None if no daemon of this user is running.
+    """
+    if not hasattr(socket, "send_fds") or not hasattr(socket, "SO_PEERCRED"):
+        return None
+    path = get_socket_path()
+    if path is None:
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        _, uid = get_peer(sock)
+    except OSError:
+        sock.close()
+        return None
+    if uid != os.getuid():
+        sock.close()
+        print(f"Not using the devtools daemon at {path}, because it runs as another user ({uid}).", file=sys.stderr)
+        return None
+    return sock
+
+def request(action: str) -> typing.Optional[dict]:
+    """Send a request without arguments (status or stop) to the daemon.
+
+    Returns:
+        typing.Optional[dict]: Reply, or None if no daemon is running.
+    """
+    sock = connect()
+    if sock is None:
+        return None
+    with sock:
+        send(sock, {"action": action})
+        reply, _ = receive(sock)
+        return reply
+
+def forward(argv: typing.List[str], started: float) -> typing.Optional[int]:
+    """Run a command in the daemon, if one is running. The standard input, output and error of this process are handed
+    to the daemon, so the output of the command (and of any process it starts) goes straight to the console. Ctrl-C is
+    passed on to the daemon, which stops the command.
+
+    Args:
+        argv (typing.List[str]): Command line arguments.
+        started (float): Value of time.perf_counter() when this process started.
+
+    Returns:
+        typing.Optional[int]: Exit code of the command, or None if it was not run by a daemon.
+    """
+    if os.getenv("DEVTOOLS_NO_DAEMON") or argv[:1] == ["daemon"] or "--serve" in argv:
+        return None
+    sock = connect()
+    if sock is None:
+        return None
+    with sock:
+        # The start time is sent as a wall clock time, which the daemon can compare to its own clock.
+        send(sock, {"action": "run", "argv": argv, "cwd": os.getcwd(), "env": dict(os.environ),
+                    "started": time.time() - (time.perf_counter() - started)}, [0, 1, 2])
+
+        # The daemon runs in its own session, so Ctrl-C in the console does not reach it by itself.
+        pid, _ = get_peer(sock)
+        previous = signal.signal(signal.SIGINT, lambda *_: os.kill(pid, signal.SIGINT))
+        try:
+            reply, _ = receive(sock)
+        finally:
+            signal.signal(signal.SIGINT, previous)
+    if reply is None:
+        print("The devtools daemon stopped while running the command.", file=sys.stderr)
+        return 1
+    return reply["exit"]
+
+def execute(run: typing.Callable[[typing.List[str], float], int], message: dict, fds: typing.List[int]) -> int:
+    """Run a command as if it was started by the client: with its standard streams, working directory and
+    environment. Ctrl-C in the client interrupts the command, but not the daemon.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(i) for i in range(3)]
+    for i, fd in enumerate(fds):
+        os.dup2(fd, i)
+        os.close(fd)
+    cwd = os.getcwd()
+    env = dict(os.environ)
+    os.chdir(message["cwd"])
+    os.environ.clear()
+    os.environ.update(message["env"])
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    try:
+        return run(message["argv"], time.perf_counter() - (time.time() - message["started"]))
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except KeyboardInterrupt:
+        print("Interrupted.")
+        return 130
+    except Exception as e:
+        print(f"Unexpected error in devtools daemon: {e}")
+        return 1
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for i, fd in enumerate(saved):
+            os.dup2(fd, i)
+            os.close(fd)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+
+def serve(run: typing.Callable[[typing.List[str], float], int], idle_timeout: float) -> None:
+    """Run commands for clients until no command was received for a while. Commands run one at a time, in the order
+    they arrive. Everything that is cached in-process (the Conan API and its remotes, the config, opened repositories)
+    stays warm between commands.
+
+    Args:
+        run (typing.Callable[[typing.List[str], float], int]): Function that runs a command line, given the value of
+            time.perf_counter() at which the client started, and returns the exit code.
+        idle_timeout (float): Seconds without requests after which the daemon exits.
+    """
+    if request("status") is not None:
+        raise RuntimeError(f"A devtools daemon is already listening on {get_socket_path()}.")
+
+    # Without a runtime directory, the socket goes in a new folder that only this user can access.
+    if os.getenv("XDG_RUNTIME_DIR"):
+        folder = None
+        path = get_socket_path()
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        folder = tempfile.mkdtemp(prefix="devtools-")
+        path = os.path.join(folder, get_socket_name())
+        with open(get_folder_record(), encoding="UTF8", mode="w") as f:
+            f.write(folder)
+
+    # Interleave nicely with the output of subprocesses, like when writing to a console.
+    sys.stdout.reconfigure(line_buffering=True)
+
+    # Only interrupted by clients, while running their command.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The socket is created with the right permissions, instead of changing them once others could already connect.
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen()
+    server.settimeout(idle_timeout)
+
+    started = time.time()
+    handled = 0
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+
+            with conn:
+                if get_peer(conn)[1] != os.getuid():
+                    continue
+                conn.settimeout(None)
+                message, fds = receive(conn)
+                if message is None:
+                    for fd in fds:
+                        os.close(fd)
+                    continue
+
+                if message["action"] == "run":
+                    handled += 1
+                    reply = {"exit": execute(run, message, fds)}
+                else:
+                    reply = {"pid": os.getpid(), "uptime": time.time() - started, "handled": handled,
+                             "idle_timeout": idle_timeout}
+
+                # The client may have gone away in the meantime.
+                try:
+                    send(conn, reply)
+                except OSError:
+                    pass
+                if message["action"] == "stop":
+                    break
+    finally:
+        server.close()
+        if folder is None:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+            if get_socket_path() == path:
+                os.remove(get_folder_record())
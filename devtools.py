@@ -1,16 +1,19 @@
+import time
+
+start = time.perf_counter()
+
 import argparse
 import os
 import platform
 import sys
+import typing
 
-from commands.clang_format import ClangFormatCommand
-from commands.clear_cache import ClearCacheCommand
-from commands.clone import CloneCommand
-from commands.cmake_generate import CmakeGenerateCommand
-from commands.conan_install import ConanInstallCommand
-from commands.export import ExportCommand
-from commands.export_deps import ExportDepsCommand
-from commands.python_packages import PythonPackagesCommand
+import daemonutils
+from commands import setup_commands
+from tracing import span, Tracer
+
+# Modules that should only be imported by commands that actually need them.
+heavy_modules = ["conan", "conans"]
 
 def validate():
     if os.getenv("DEVTOOLS_ROOT_DIR") is None:
@@ -20,36 +23,77 @@ def validate():
     if not os.path.exists(os.path.join(os.getenv("DEVTOOLS_ROOT_DIR"), "devtools.ini")):
         raise RuntimeError("Could not find INI file.")
 
-if __name__ == "__main__":
-    validate()
+def main(argv: typing.List[str], started: typing.Optional[float] = None) -> int:
+    """Run a command line.
+
+    Args:
+        argv (typing.List[str]): Command line arguments.
+        started (typing.Optional[float]): Value of time.perf_counter() at which the command was started, if it was not
+            this process that started it (i.e. when the daemon runs it for a client).
+
+    Returns:
+        int: Exit code.
+    """
+    # Options that apply to all commands. They are parsed on their own first, so the values they take are not mistaken
+    # for the name of the command.
+    options = argparse.ArgumentParser(prog="devtools", add_help=False)
+    options.add_argument("--startup-time", dest="startup_time", action="store_true", help="Instead of running the\
+                        command, report how long it took to get ready to run it and which heavy modules were imported.")
+    options.add_argument("--trace", dest="trace", required=False, help="Record how long each step of the command\
+                        took (clones, exports, graph loads, etc.) and write it to this file in the Chrome trace\
+                        format. A summary of the slowest steps is printed as well.")
+    # Used by the daemon command to start the daemon process, with the idle timeout in minutes.
+    options.add_argument("--serve", dest="serve", type=float, required=False, help=argparse.SUPPRESS)
+    _, remaining = options.parse_known_args(argv)
 
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(prog="devtools", parents=[options])
     subparsers = parser.add_subparsers()
 
-    ClangFormatCommand.setup(subparsers)
-    ClearCacheCommand.setup(subparsers)
-    CloneCommand.setup(subparsers)
-    ExportCommand.setup(subparsers)
-    ExportDepsCommand.setup(subparsers)
-    CmakeGenerateCommand.setup(subparsers)
-    ConanInstallCommand.setup(subparsers)
-    PythonPackagesCommand.setup(subparsers)
+    setup_commands(subparsers, remaining)
 
-    a = parser.parse_args()
+    a = parser.parse_args(argv)
+
+    if a.serve is not None:
+        daemonutils.serve(main, a.serve * 60)
+        return 0
+
+    if a.startup_time:
+        loaded = sorted(m for m in heavy_modules if m in sys.modules)
+        print(f"Startup took {(time.perf_counter() - (start if started is None else started)) * 1000:.1f} ms.")
+        print(f"Heavy modules imported: {', '.join(loaded) if loaded else 'none'}.")
+        return 1 if loaded else 0
+
+    Tracer.enable(bool(a.trace))
 
     try:
-        problems = a.func(a)
+        with span("command", argv=" ".join(argv)):
+            problems = a.func(a)
     except Exception as ee:
         print("=====================================================")
         print(f"Failed to run devtools command. Unexpected error: {ee}")
-        sys.exit(1)
+        return 1
+    finally:
+        if a.trace:
+            Tracer.save(a.trace)
+            Tracer.summary()
+            print(f"Trace written to {a.trace}.")
 
     if problems:
         print("")
         print("Failed to run command. Known problems:")
         for p in problems:
             print(f"  {p}")
-        sys.exit(1)
+        return 1
 
     print("=====================================================")
     print("devtools ran successfully.")
+    return 0
+
+if __name__ == "__main__":
+    validate()
+
+    # Let a running daemon handle the command, if there is one.
+    code = daemonutils.forward(sys.argv[1:], start)
+    if code is None:
+        code = main(sys.argv[1:])
+    sys.exit(code)
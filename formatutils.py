@@ -0,0 +1,349 @@
+import concurrent.futures
+import difflib
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import typing
+import xml.etree.ElementTree as ET
+
+from tracing import span
+
+extensions = [".h", ".cpp"]
+
+# Directories that never contain sources that should be formatted.
+ignored_dirs = [".git", "build", "out"]
+
+config_files = [".clang-format", "_clang-format"]
+
+def hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class FormatCache:
+    """Persistent record of files that are known to be formatted. Each entry stores the modification time, size and
+    content hash of a file as it was after formatting. The whole record is tied to a key derived from the clang-format
+    version and configuration, so that it is discarded when either of those changes.
+    """
+    def __init__(self, path: str, key: str) -> None:
+        self.path = path
+        self.key = key
+        self.entries = {}
+        try:
+            with open(path, encoding="UTF8") as f:
+                data = json.load(f)
+            if data.get("key") == key:
+                self.entries = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+
+    def unchanged(self, file: str) -> bool:
+        entry = self.entries.get(file)
+        if entry is None:
+            return False
+
+        # A matching stat means the file was not touched. Otherwise compare contents, so that a touched but
+        # otherwise identical file is not formatted again.
+        st = os.stat(file)
+        if entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return True
+        if entry[2] == hash_file(file):
+            self.entries[file] = [st.st_mtime_ns, st.st_size, entry[2]]
+            return True
+        return False
+
+    def update(self, file: str) -> None:
+        st = os.stat(file)
+        self.entries[file] = [st.st_mtime_ns, st.st_size, hash_file(file)]
+
+    def prune(self, files: typing.Iterable[str]) -> None:
+        keep = set(files)
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
+
+    def save(self) -> None:
+        with open(self.path, encoding="UTF8", mode="w") as f:
+            json.dump({"key": self.key, "files": self.entries}, f)
+
+class FormatUtils:
+    @staticmethod
+    def find_clang_format() -> typing.Optional[str]:
+        """Find the clang-format executable. The CLANG_FORMAT environment variable takes precedence. On Windows, the
+        version shipped with Visual Studio is used. Otherwise the PATH is searched, including versioned executables
+        such as clang-format-17.
+
+        Returns:
+            typing.Optional[str]: Path to clang-format, or None if it could not be found.
+        """
+        if os.getenv("CLANG_FORMAT"):
+            return os.getenv("CLANG_FORMAT")
+
+        if platform.system() == "Windows" and os.getenv("VCINSTALLDIR"):
+            path = os.path.join(os.getenv("VCINSTALLDIR"), "Tools/Llvm/x64/bin/clang-format.exe")
+            if os.path.exists(path):
+                return path
+
+        path = shutil.which("clang-format")
+        if path:
+            return path
+
+        for version in range(25, 9, -1):
+            path = shutil.which(f"clang-format-{version}")
+            if path:
+                return path
+
+        return None
+
+    @staticmethod
+    def get_version(cf: str) -> str:
+        return subprocess.check_output([cf, "--version"], text=True).strip()
+
+    @staticmethod
+    def collect_files(folder: str, configs: typing.Optional[typing.List[str]] = None) -> typing.List[str]:
+        """Recursively collect all files that should be formatted.
+
+        Args:
+            folder (str): Root folder.
+            configs (typing.Optional[typing.List[str]]): Optional list to which all encountered clang-format
+            configuration files are appended.
+
+        Returns:
+            typing.List[str]: Sorted list of file paths.
+        """
+        files = []
+        for root, dirs, filenames in os.walk(folder):
+            dirs[:] = [d for d in dirs if d not in ignored_dirs]
+            files.extend(os.path.join(root, f) for f in filenames if os.path.splitext(f)[1] in extensions)
+            if configs is not None:
+                configs.extend(os.path.join(root, f) for f in filenames if f in config_files)
+        return sorted(files)
+
+    @staticmethod
+    def get_cache_key(cf: str, folder: str, configs: typing.Iterable[str]) -> str:
+        """Compute a key that identifies the formatting rules for a folder: the clang-format version and the contents
+        of all configuration files that apply, including those in parent folders.
+
+        Args:
+            cf (str): Path to clang-format.
+            folder (str): Root folder.
+            configs (typing.Iterable[str]): Configuration files found inside of the root folder.
+
+        Returns:
+            str: Key.
+        """
+        paths = set(configs)
+        parent = os.path.dirname(os.path.abspath(folder))
+        while True:
+            paths.update(os.path.join(parent, f) for f in config_files if os.path.isfile(os.path.join(parent, f)))
+            if os.path.dirname(parent) == parent:
+                break
+            parent = os.path.dirname(parent)
+
+        h = hashlib.sha256(FormatUtils.get_version(cf).encode())
+        for path in sorted(paths):
+            h.update(path.encode())
+            h.update(hash_file(path).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def make_batches(files: typing.List[str], jobs: int, batch_size: int) -> typing.List[typing.List[str]]:
+        """Split a list of files into batches. Batches are made small enough that all jobs get work to do, but never
+        larger than batch_size to keep command lines short.
+
+        Args:
+            files (typing.List[str]): Files.
+            jobs (int): Number of concurrent jobs.
+            batch_size (int): Maximum number of files per batch.
+
+        Returns:
+            typing.List[typing.List[str]]: Batches.
+        """
+        size = max(1, min(batch_size, -(-len(files) // max(1, jobs))))
+        return [files[i:i + size] for i in range(0, len(files), size)]
+
+    @staticmethod
+    def format_files(cf: str, files: typing.List[str], jobs: int = 0,
+                     batch_size: int = 50) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """Format files in place. Files are grouped into batches, each of which is formatted by a single clang-format
+        process. Batches run concurrently.
+
+        Args:
+            cf (str): Path to clang-format.
+            files (typing.List[str]): Files to format.
+            jobs (int): Number of concurrent clang-format processes. Defaults to the number of cores.
+            batch_size (int): Maximum number of files per clang-format process.
+
+        Returns:
+            typing.Tuple[typing.List[str], typing.List[str]]: List of files that were formatted successfully and list
+            of problems.
+        """
+        jobs = jobs or os.cpu_count() or 1
+        formatted = []
+        problems = []
+
+        def run(batch: typing.List[str]) -> typing.Optional[str]:
+            with span("format batch", files=len(batch), first=batch[0]):
+                result = subprocess.run([cf, "-i", *batch], stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                return f"clang-format failed on a batch starting with {batch[0]}: {result.stderr.strip()}"
+            return None
+
+        # Each worker only waits for its clang-format process, so threads are enough to keep all cores busy.
+        batches = FormatUtils.make_batches(files, jobs, batch_size)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            for batch, err in zip(batches, executor.map(run, batches)):
+                if err:
+                    problems.append(err)
+                else:
+                    formatted.extend(batch)
+
+        return formatted, problems
+
+    @staticmethod
+    def find_violations(data: bytes, replacements: str) -> typing.List[typing.Tuple[int, int]]:
+        """Apply the replacements clang-format suggests for a file in memory, and compare the result with the original
+        contents.
+
+        Args:
+            data (bytes): Original file contents.
+            replacements (str): Output of clang-format --output-replacements-xml for the file.
+
+        Returns:
+            typing.List[typing.Tuple[int, int]]: First and last line (1-based, inclusive) of each range of lines that
+            formatting would change.
+        """
+        # Offsets are byte offsets into the original contents, so replacements are applied back to front.
+        formatted = data
+        elements = ET.fromstring(replacements).findall("replacement")
+        for r in sorted(elements, key=lambda e: int(e.get("offset")), reverse=True):
+            offset = int(r.get("offset"))
+            formatted = formatted[:offset] + (r.text or "").encode() + formatted[offset + int(r.get("length")):]
+        if formatted == data:
+            return []
+
+        original = data.splitlines(keepends=True)
+        matcher = difflib.SequenceMatcher(None, original, formatted.splitlines(keepends=True), autojunk=False)
+        ranges = []
+        for tag, i1, i2, _, _ in matcher.get_opcodes():
+            if tag != "equal":
+                # Lines that are only inserted are attributed to the line they are inserted before.
+                first = min(i1 + 1, max(1, len(original)))
+                ranges.append((first, max(first, i2)))
+        return ranges
+
+    @staticmethod
+    def check_files(cf: str, files: typing.List[str], jobs: int = 0, batch_size: int = 50,
+                    max_violations: int = 0) -> typing.Tuple[typing.List[str], typing.Dict[str, list],
+                                                            typing.List[str], bool]:
+        """Check whether files are formatted, without modifying them. Files are grouped into batches, each of which is
+        checked by a single clang-format process. Batches run concurrently.
+
+        Args:
+            cf (str): Path to clang-format.
+            files (typing.List[str]): Files to check.
+            jobs (int): Number of concurrent clang-format processes. Defaults to the number of cores.
+            batch_size (int): Maximum number of files per clang-format process.
+            max_violations (int): Stop once this many ranges of unformatted lines were found. 0 means no limit.
+
+        Returns:
+            typing.Tuple[typing.List[str], typing.Dict[str, list], typing.List[str], bool]: Files that are formatted,
+            the ranges of unformatted lines of each unformatted file, problems and whether all files were checked.
+        """
+        jobs = jobs or os.cpu_count() or 1
+        clean = []
+        violations = {}
+        problems = []
+
+        def run(batch: typing.List[str]) -> typing.Tuple[typing.Dict[str, list], typing.Optional[str]]:
+            with span("check batch", files=len(batch), first=batch[0]):
+                result = subprocess.run([cf, "--output-replacements-xml", *batch], stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                return {}, f"clang-format failed on a batch starting with {batch[0]}: " \
+                           f"{result.stderr.decode(errors='replace').strip()}"
+
+            # The replacements for each file are a separate XML document, in the order the files were passed. Their
+            # offsets are in bytes of the UTF-8 encoded file, so the output is decoded as UTF-8 regardless of locale.
+            output = result.stdout.decode("UTF8")
+            documents = ["<?xml" + d for d in output.split("<?xml")[1:]]
+            if len(documents) != len(batch):
+                return {}, f"clang-format returned {len(documents)} results for a batch of {len(batch)} files " \
+                           f"starting with {batch[0]}."
+            ranges = {}
+            for file, document in zip(batch, documents):
+                with open(file, "rb") as f:
+                    ranges[file] = FormatUtils.find_violations(f.read(), document)
+            return ranges, None
+
+        processed = set()
+
+        def collect(future: concurrent.futures.Future) -> None:
+            ranges, err = future.result()
+            if err:
+                problems.append(err)
+            for file, r in ranges.items():
+                if r:
+                    violations[file] = r
+                else:
+                    clean.append(file)
+            processed.add(future)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            futures = [executor.submit(run, batch) for batch in FormatUtils.make_batches(files, jobs, batch_size)]
+            for future in concurrent.futures.as_completed(futures):
+                collect(future)
+                if max_violations and sum(len(r) for r in violations.values()) >= max_violations:
+                    break
+        finally:
+            # Batches that did not start yet are dropped. Batches that are running are not waited for, and their
+            # results are not used.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # Batches that finished while the last result was processed are not thrown away.
+        for future in futures:
+            if future not in processed and future.done() and not future.cancelled():
+                collect(future)
+
+        return clean, violations, problems, len(processed) == len(futures)
+
+    @staticmethod
+    def write_report(path: str, source: str, checked: typing.List[str], violations: typing.Dict[str, list],
+                     complete: bool) -> None:
+        """Write the result of a check to a file: a JUnit report with a test case per checked file if the file name
+        ends in .xml, and a JSON report otherwise.
+
+        Args:
+            path (str): Report file.
+            source (str): Folder that the file names in the report are relative to.
+            checked (typing.List[str]): All files that were checked, including the unformatted ones.
+            violations (typing.Dict[str, list]): Ranges of unformatted lines of each unformatted file.
+            complete (bool): Whether all files were checked.
+        """
+        files = sorted(checked)
+        if os.path.splitext(path)[1].lower() != ".xml":
+            with open(path, encoding="UTF8", mode="w") as f:
+                json.dump({
+                    "complete": complete,
+                    "checked": len(files),
+                    "violations": [{"file": os.path.relpath(file, source), "lines": violations[file]}
+                                   for file in files if file in violations]
+                }, f, indent=4)
+            return
+
+        import xml.etree.ElementTree as ET
+
+        root = ET.Element("testsuites")
+        suite = ET.SubElement(root, "testsuite", name="clang-format", tests=str(len(files)),
+                              failures=str(len(violations)), errors="0", skipped="0")
+        for file in files:
+            name = os.path.relpath(file, source)
+            case = ET.SubElement(suite, "testcase", classname="clang-format", name=name)
+            if file in violations:
+                lines = ", ".join(f"{a}-{b}" if a != b else str(a) for a, b in violations[file])
+                message = f"{name} is not formatted, lines {lines}."
+                ET.SubElement(case, "failure", message=message, type="formatting").text = message
+        if not complete:
+            ET.SubElement(suite, "system-out").text = "Stopped early, not all files were checked."
+        ET.ElementTree(root).write(path, encoding="UTF-8", xml_declaration=True)
@@ -1,53 +1,634 @@
+import atexit
 import configparser
+import hashlib
 import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
 import typing
 
-import git
+from tracing import span, traced
+from utils import get_cache_dir, get_project_url, check_call_logged
 
-class RestorableCommit:
-    def __init__(self, repo: git.Repo) -> None:
-        self.repo = repo
-        self.detached = self.repo.head.is_detached
-        self.commit = self.repo.head.object.hexsha if self.detached else None
-        self.branch = self.repo.active_branch.name if not self.detached else None
+def resolve_url(base: str, url: str) -> str:
+    """Resolve a submodule URL that may be relative to the URL of its parent repository."""
+    if not url.startswith("./") and not url.startswith("../"):
+        return url
+    base = base.rstrip("/")
+    for part in url.split("/"):
+        if part == "..":
+            base = base[:max(base.rfind("/"), base.rfind(":"))]
+        elif part != ".":
+            base = f"{base}/{part}"
+    return base
 
-    def restore(self):
-        if self.detached:
-            print(f"Restoring to commit {self.commit}.")
-            self.repo.git.checkout(self.commit)
-        else:
-            print(f"Restoring to branch {self.branch}.")
-            self.repo.git.checkout(self.branch)
+class BatchProcess:
+    """A long-lived `git cat-file` process in batch mode. Every lookup is a line written to the process instead of a
+    new git process, which makes resolving many refs or reading many files nearly free. Objects added to the repository
+    after the process started (e.g. by a fetch) are still found.
+    """
+    def __init__(self, git_dir: str, mode: str) -> None:
+        self.git_dir = git_dir
+        self.mode = mode
+        self.proc = None
+        self.lock = threading.Lock()
+
+    def query(self, name: str) -> typing.Optional[typing.Tuple[str, str, bytes]]:
+        """Look up an object.
+
+        Args:
+            name (str): Object name, e.g. a commit hash, v1.0.0^{commit} or HEAD:conanfile.py.
+
+        Returns:
+            typing.Optional[typing.Tuple[str, str, bytes]]: Hash, type and contents (empty in --batch-check mode) of
+            the object, or None if it does not exist.
+        """
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self.proc = subprocess.Popen(["git", "--git-dir", self.git_dir, "cat-file", self.mode],
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.proc.stdin.write(name.encode() + b"\n")
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline().decode().rstrip("\n")
+            # Names that do not resolve are echoed back, and may contain spaces themselves.
+            if line.endswith((" missing", " ambiguous")):
+                return None
+            info = line.split()
+            if len(info) != 3:
+                return None
+            content = b""
+            if self.mode == "--batch":
+                content = self.proc.stdout.read(int(info[2]) + 1)[:-1]
+            return info[0], info[1], content
+
+    def close(self) -> None:
+        with self.lock:
+            if self.proc is not None:
+                self.proc.stdin.close()
+                self.proc.wait()
+                self.proc = None
+
+class Repository:
+    """Read access to a repository. HEAD, branches and tags are read directly from the files in the git directory, and
+    objects are looked up through long-lived cat-file processes, so that reading does not start a git process per call.
+    Operations that modify the repository go through the git command line.
+
+    Repositories stay open, so opening the same one again (e.g. from the next command handled by the daemon) reuses the
+    running processes.
+    """
+    instances = {}
+    instances_lock = threading.Lock()
+
+    def __init__(self, path: str, git_dir: str) -> None:
+        self.path = path
+        self.git_dir = git_dir
+        self.common_dir = git_dir
+        commondir = os.path.join(git_dir, "commondir")
+        if os.path.isfile(commondir):
+            with open(commondir, encoding="UTF8") as f:
+                self.common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+        self.identity = os.stat(git_dir).st_ino
+        self.packed = (None, {})
+        self.check = BatchProcess(git_dir, "--batch-check")
+        self.batch = BatchProcess(git_dir, "--batch")
+
+    @staticmethod
+    def find_git_dir(path: str) -> typing.Optional[str]:
+        """Find the git directory of a working tree, or of a bare repository."""
+        dotgit = os.path.join(path, ".git")
+        if os.path.isdir(dotgit):
+            return dotgit
+        if os.path.isfile(dotgit):
+            # Submodules and worktrees have a file pointing to their git directory.
+            with open(dotgit, encoding="UTF8") as f:
+                line = f.read().strip()
+            if line.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(path, line[len("gitdir:"):].strip()))
+        if os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(os.path.join(path, "objects")):
+            return path
+        return None
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return Repository.find_git_dir(path) is not None
+
+    @staticmethod
+    def open(path: str) -> "Repository":
+        path = os.path.abspath(path)
+        git_dir = Repository.find_git_dir(path)
+        if git_dir is None:
+            raise RuntimeError(f"There is no git repository at {path}.")
+
+        with Repository.instances_lock:
+            repo = Repository.instances.get(path)
+            # The repository may have been deleted and cloned again since it was opened.
+            if repo is not None and (repo.git_dir != git_dir or not os.path.isdir(git_dir) or
+                                     os.stat(git_dir).st_ino != repo.identity):
+                repo.close()
+                repo = None
+            if repo is None:
+                repo = Repository(path, git_dir)
+                Repository.instances[path] = repo
+            return repo
+
+    @staticmethod
+    def forget(path: str) -> None:
+        """Close a repository, e.g. before deleting it."""
+        with Repository.instances_lock:
+            repo = Repository.instances.pop(os.path.abspath(path), None)
+        if repo is not None:
+            repo.close()
+
+    @staticmethod
+    def close_all() -> None:
+        with Repository.instances_lock:
+            repos = list(Repository.instances.values())
+            Repository.instances.clear()
+        for repo in repos:
+            repo.close()
+
+    def close(self) -> None:
+        self.check.close()
+        self.batch.close()
+
+    def packed_refs(self) -> typing.Dict[str, typing.Tuple[str, typing.Optional[str]]]:
+        """Get all packed refs, as name mapped to hash and peeled commit (for annotated tags)."""
+        path = os.path.join(self.common_dir, "packed-refs")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        if self.packed[0] == mtime:
+            return self.packed[1]
+
+        refs = {}
+        last = None
+        with open(path, encoding="UTF8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.startswith("^") and last:
+                    refs[last] = (refs[last][0], line[1:])
+                elif line and not line.startswith("#"):
+                    sha, last = line.split(" ", 1)
+                    refs[last] = (sha, None)
+        self.packed = (mtime, refs)
+        return refs
+
+    def read_ref(self, name: str) -> typing.Optional[str]:
+        """Resolve a full ref name (e.g. HEAD or refs/heads/main), following symbolic refs.
+
+        Returns:
+            typing.Optional[str]: Hash the ref points to, or None if it does not exist.
+        """
+        for _ in range(8):
+            value = None
+            for folder in [self.git_dir, self.common_dir]:
+                try:
+                    with open(os.path.join(folder, name), encoding="UTF8") as f:
+                        value = f.read().strip()
+                    break
+                except OSError:
+                    pass
+            if value is None:
+                packed = self.packed_refs().get(name)
+                return packed[0] if packed else None
+            if not value.startswith("ref:"):
+                return value
+            name = value[len("ref:"):].strip()
+        return None
+
+    def head(self) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+        """Get the current commit (None if there are no commits yet) and branch (e.g. refs/heads/main, None if HEAD is
+        detached).
+        """
+        with open(os.path.join(self.git_dir, "HEAD"), encoding="UTF8") as f:
+            value = f.read().strip()
+        if value.startswith("ref:"):
+            branch = value[len("ref:"):].strip()
+            return self.read_ref(branch), branch
+        return value, None
+
+    def refs(self, prefix: str) -> typing.Dict[str, str]:
+        """Get all refs that start with a prefix, e.g. refs/tags/, mapped to the hash they point to."""
+        refs = {name: sha for name, (sha, _) in self.packed_refs().items() if name.startswith(prefix)}
+        root = os.path.join(self.common_dir, *prefix.rstrip("/").split("/"))
+        for folder, _, files in os.walk(root):
+            for file in files:
+                name = "/".join([prefix.rstrip("/"), *os.path.relpath(os.path.join(folder, file), root).split(os.sep)])
+                sha = self.read_ref(name)
+                if sha:
+                    refs[name] = sha
+        return refs
+
+    def tags_at(self, commit: str) -> typing.List[str]:
+        """Get the names of all tags that point to a commit, both lightweight and annotated ones."""
+        packed = self.packed_refs()
+        tags = []
+        for name, sha in self.refs("refs/tags/").items():
+            peeled = packed[name][1] if name in packed and packed[name][0] == sha else None
+            if sha == commit or (peeled or self.resolve(sha)) == commit:
+                tags.append(name[len("refs/tags/"):])
+        return sorted(tags)
+
+    def resolve(self, rev: str, kind: str = "commit") -> typing.Optional[str]:
+        """Resolve a revision to the hash of an object of a specific kind.
+
+        Args:
+            rev (str): Branch, tag, commit or any other revision.
+            kind (str): Object type, e.g. commit or tree.
+
+        Returns:
+            typing.Optional[str]: Hash, or None if the revision does not exist.
+        """
+        result = self.check.query(f"{rev}^{{{kind}}}")
+        return result[0] if result else None
+
+    def read_file(self, rev: str, path: str) -> typing.Optional[bytes]:
+        """Read the contents of a file as it is in a revision.
+
+        Args:
+            rev (str): Branch, tag or commit.
+            path (str): Path relative to the root of the repository.
+
+        Returns:
+            typing.Optional[bytes]: Contents, or None if the file does not exist in the revision.
+        """
+        result = self.batch.query(f"{rev}:{path}")
+        return result[2] if result and result[1] == "blob" else None
+
+# The cat-file processes would otherwise only stop when their pipes are closed at exit.
+atexit.register(Repository.close_all)
+
+# Matches a recipe that sets its revision from the git commit.
+scm_revision_pattern = re.compile(rb"""revision_mode\s*=\s*["']scm["']""")
+
+# Supported ways of cloning repositories, see GitUtils.clone_url.
+clone_strategies = ["full", "blobless", "shallow", "single-branch"]
 
 class GitUtils:
     @staticmethod
-    def clone_url(url, target) -> git.Repo:
-        print(f"Cloning repository from {url} to {target}.")
-        repo = git.Repo.clone_from(url=url, to_path=target)
+    def archive(repo_dir: str, ref: str, target: str) -> None:
+        """Write the tree of a commit to a folder, without touching the working tree or index of the repository.
+        Submodules are not included, see list_submodules.
 
-        # Retrieve submodules.
-        for submodule in repo.submodules:
-            submodule.update(init=True)
+        Args:
+            repo_dir (str): Repository, can be bare.
+            ref (str): Branch, tag or commit.
+            target (str): Target folder. Created if it does not exist.
+        """
+        os.makedirs(target, exist_ok=True)
+        with span("archive", repo=repo_dir, ref=ref):
+            proc = subprocess.Popen(["git", "-C", repo_dir, "archive", "--format=tar", ref], stdout=subprocess.PIPE)
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(target, filter="data")
+                else:
+                    tar.extractall(target)
+            if proc.wait() != 0:
+                raise RuntimeError(f"Failed to archive {ref} from {repo_dir}.")
 
-        return repo
-    
     @staticmethod
-    def open_or_clone_url(url, target) -> git.Repo:
-        if os.path.exists(os.path.join(target, ".git")):
-            print(f"Opening existing repository at {target}.")
-            repo = git.Repo(target)
-        else:
-            print(f"Cloning repository from {url} to {target}.")
-            repo = git.Repo.clone_from(url=url, to_path=target)
+    def write_tree(repo_dir: str, ref: str, target: str, url: str, log: typing.Callable[..., None] = print,
+                   clone: bool = False) -> None:
+        """Write the tree of a ref to a folder, like archive. A recipe that uses git itself (through
+        conan.tools.scm, e.g. in set_version or export, or with revision_mode = "scm") needs a repository to work
+        with, so in that case the ref is cloned from the local repository instead, with the origin pointing at the
+        original URL.
+
+        Args:
+            repo_dir (str): Repository, can be bare.
+            ref (str): Branch, tag or commit.
+            target (str): Target folder. Must be empty if it exists.
+            url (str): URL to use as origin of a clone.
+            log (typing.Callable[..., None]): Log function.
+            clone (bool): Always clone, e.g. for a recipe that uses git through a python_requires base class.
+        """
+        conanfile = Repository.open(repo_dir).read_file(ref, "conanfile.py") or b""
+        if not clone and b"conan.tools.scm" not in conanfile and not scm_revision_pattern.search(conanfile):
+            GitUtils.archive(repo_dir, ref, target)
+            return
+
+        log(f"Recipe uses git, cloning {ref} instead of archiving it.")
+        with span("local clone", repo=repo_dir, ref=ref):
+            check_call_logged(["git", "clone", "--quiet", "--no-checkout", repo_dir, target], log)
+            check_call_logged(["git", "-C", target, "checkout", "--quiet", ref], log)
+            if url:
+                check_call_logged(["git", "-C", target, "remote", "set-url", "origin", url], log)
+
+    @staticmethod
+    def list_submodules(repo_dir: str, ref: str) -> typing.List[typing.Tuple[str, str, str]]:
+        """List the submodules of a commit.
+
+        Args:
+            repo_dir (str): Repository, can be bare.
+            ref (str): Branch, tag or commit.
+
+        Returns:
+            typing.List[typing.Tuple[str, str, str]]: List of path, commit and (possibly relative) URL.
+        """
+        tree = subprocess.check_output(["git", "-C", repo_dir, "ls-tree", "-r", "-z", ref], text=True)
+        commits = {}
+        for line in tree.split("\0"):
+            if line.startswith("160000 commit "):
+                info, path = line.split("\t", 1)
+                commits[path] = info.split(" ")[2]
+        if not commits:
+            return []
+
+        modules = subprocess.run(["git", "-C", repo_dir, "config", "--blob", f"{ref}:.gitmodules", "--get-regexp",
+                                  r"^submodule\..*\.(path|url)$"], stdout=subprocess.PIPE, text=True).stdout
+        paths = {}
+        urls = {}
+        for line in modules.splitlines():
+            key, value = line.split(" ", 1)
+            name, field = key[len("submodule."):].rsplit(".", 1)
+            (paths if field == "path" else urls)[name] = value
+
+        return [(path, commits[path], urls[name]) for name, path in sorted(paths.items())
+                if path in commits and name in urls]
+
+    @staticmethod
+    @traced("snapshot")
+    def snapshot(repo_dir: str, ref: str, target: str, mirrors: "MirrorCache",
+                 log: typing.Callable[..., None] = print, clone: bool = False) -> None:
+        """Write the tree of a ref, including all submodules, to a folder without touching the working tree of the
+        repository. Submodules are read from their local checkouts when those contain the required commit, and from
+        mirrors otherwise.
+
+        Args:
+            repo_dir (str): Repository.
+            ref (str): Branch, tag or commit.
+            target (str): Target folder.
+            mirrors (MirrorCache): Mirrors for submodules that are not available locally.
+            log (typing.Callable[..., None]): Log function.
+            clone (bool): Always clone the repository itself, see write_tree.
+        """
+        log(f"Writing snapshot of {ref} in {repo_dir} to {target}.")
+        url = subprocess.run(["git", "-C", repo_dir, "config", "--get", "remote.origin.url"], stdout=subprocess.PIPE,
+                             text=True).stdout.strip()
+        GitUtils.write_tree(repo_dir, ref, target, url, log, clone)
+        submodules = GitUtils.list_submodules(repo_dir, ref)
+        if not submodules:
+            return
+
+        for path, commit, sub_url in submodules:
+            local = os.path.join(repo_dir, path)
+            if os.path.exists(os.path.join(local, ".git")) and MirrorCache.contains(local, commit):
+                GitUtils.snapshot(local, commit, os.path.join(target, path), mirrors, log)
+            else:
+                mirrors.checkout(resolve_url(url, sub_url), commit, os.path.join(target, path), log)
+
+    @staticmethod
+    def tree_hash(repo_dir: str, ref: typing.Optional[str] = None) -> str:
+        """Get the hash of the git tree object of a ref, or of the current working tree. For the working tree, all
+        changes including untracked (but not ignored) files are added to a temporary copy of the index, so the real
+        index is left untouched. The blobs and trees this creates go to a temporary object directory, which uses the
+        real one as an alternate, so the repository does not fill up with objects of every state the working tree was
+        hashed in. Changes inside of submodules are only reflected through their checked out commit.
+
+        Args:
+            repo_dir (str): Repository.
+            ref (typing.Optional[str]): Branch, tag or commit. If None, the working tree is used.
+
+        Returns:
+            str: Tree hash.
+        """
+        with span("tree hash", repo=repo_dir, ref=ref):
+            repo = Repository.open(repo_dir)
+            if ref:
+                tree = repo.resolve(ref, "tree")
+                if tree is None:
+                    raise RuntimeError(f"Failed to resolve {ref} in {repo_dir}.")
+                return tree
+
+            index = os.path.join(repo.git_dir, "index")
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp, "index"),
+                           GIT_OBJECT_DIRECTORY=os.path.join(tmp, "objects"),
+                           GIT_ALTERNATE_OBJECT_DIRECTORIES=os.path.join(repo.common_dir, "objects"))
+                if os.path.exists(index):
+                    shutil.copyfile(index, env["GIT_INDEX_FILE"])
+                os.mkdir(env["GIT_OBJECT_DIRECTORY"])
+                subprocess.check_call(["git", "-C", repo_dir, "add", "-A"], env=env)
+                return subprocess.check_output(["git", "-C", repo_dir, "write-tree"], env=env, text=True).strip()
 
-            # Retrieve submodules.
-            for submodule in repo.submodules:
-                submodule.update(init=True)
+    @staticmethod
+    def changed_files(source: str, ref: typing.Optional[str] = None, staged: bool = False,
+                      untracked: bool = False) -> typing.List[str]:
+        """List files that git reports as changed, without touching the working tree. Deleted files are left out.
+
+        Args:
+            source (str): Repository root.
+            ref (typing.Optional[str]): Compare the working tree against this ref. Defaults to HEAD.
+            staged (bool): Only list changes in the index, instead of in the working tree.
+            untracked (bool): Also list untracked files that are not ignored.
+
+        Returns:
+            typing.List[str]: Absolute paths of changed files.
+        """
+        diff = ["git", "-C", source, "diff", "--name-only", "-z", "--diff-filter=ACMR"]
+        if staged:
+            diff.append("--cached")
+        diff.append(ref or "HEAD")
+        with span("git diff", repo=source, ref=ref):
+            paths = subprocess.check_output([*diff, "--"], text=True).split("\0")
+            if untracked:
+                paths.extend(subprocess.check_output(["git", "-C", source, "ls-files", "-z", "--others",
+                                                      "--exclude-standard"], text=True).split("\0"))
+        # A file that is staged can still be deleted from the working tree since.
+        return sorted(set(f for f in (os.path.join(source, p) for p in paths if p) if os.path.isfile(f)))
+
+    @staticmethod
+    def tracked_files(source: str, *patterns: str) -> typing.List[str]:
+        """List files in the index that match any of the given pathspecs.
+
+        Args:
+            source (str): Repository root.
+            *patterns (str): Pathspecs.
+
+        Returns:
+            typing.List[str]: Absolute paths of matching files.
+        """
+        paths = subprocess.check_output(["git", "-C", source, "ls-files", "-z", "--", *patterns],
+                                        text=True).split("\0")
+        return sorted(os.path.join(source, p) for p in paths if p)
+
+    @staticmethod
+    def head(source: str) -> typing.Tuple[str, typing.Optional[str], typing.Optional[str]]:
+        """Get the git directory, current commit and current branch of a repository.
+
+        Args:
+            source (str): Repository root.
+
+        Returns:
+            typing.Tuple[str, typing.Optional[str], typing.Optional[str]]: Absolute git directory, commit (None if
+            there are no commits yet) and full branch name, e.g. refs/heads/main (None if HEAD is detached).
+        """
+        repo = Repository.open(source)
+        return (repo.git_dir, *repo.head())
+
+    @staticmethod
+    def sync(source: str, ref: typing.Optional[str] = None, log: typing.Callable[..., None] = print,
+             submodule_jobs: int = 1) -> str:
+        """Fetch an existing repository and its submodules, and bring the working tree up to date when that can be done
+        safely. The current branch is only fast-forwarded to its upstream branch, and a repository with uncommitted
+        changes or a branch that diverged from its upstream is left untouched.
+
+        Args:
+            source (str): Repository root.
+            ref (typing.Optional[str]): Branch or tag to check out after fetching, instead of updating the current
+            branch.
+            log (typing.Callable[..., None]): Log function.
+            submodule_jobs (int): Number of submodules that are fetched at the same time.
+
+        Returns:
+            str: Short description of the resulting state, e.g. up to date, diverged or dirty.
+        """
+        def query(*args: str) -> typing.Optional[str]:
+            result = subprocess.run(["git", "-C", source, *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    text=True)
+            return result.stdout.strip() if result.returncode == 0 else None
+
+        jobs = f"--jobs={max(1, submodule_jobs)}"
+        with span("fetch", repo=source):
+            check_call_logged(["git", "-C", source, "fetch", "--prune", "--tags", "--recurse-submodules=on-demand",
+                               jobs, "origin"], log)
+
+        if query("status", "--porcelain", "--untracked-files=no"):
+            return "dirty"
+
+        if ref:
+            check_call_logged(["git", "-C", source, "checkout", "--quiet", ref], log)
+            check_call_logged(["git", "-C", source, "submodule", "update", "--init", jobs], log)
+            return f"checked out {ref}"
+
+        if Repository.open(source).head()[1] is None:
+            return "detached"
+        counts = query("rev-list", "--left-right", "--count", "HEAD...@{upstream}")
+        if counts is None:
+            return "no upstream"
+
+        ahead, behind = (int(c) for c in counts.split())
+        if ahead and behind:
+            return f"diverged ({ahead} ahead, {behind} behind)"
+        if not behind:
+            return f"ahead by {ahead}" if ahead else "up to date"
+
+        with span("fast-forward", repo=source):
+            check_call_logged(["git", "-C", source, "merge", "--ff-only", "--quiet", "@{upstream}"], log)
+            check_call_logged(["git", "-C", source, "submodule", "update", "--init", jobs], log)
+        return f"fast-forwarded by {behind}"
+
+    @staticmethod
+    def clone_url(url, target, log: typing.Callable[..., None] = print, strategy: str = "full",
+                  ref: typing.Optional[str] = None, submodule_jobs: int = 1) -> Repository:
+        """Clone a repository and initialize its submodules.
+
+        Args:
+            url: Repository URL.
+            target: Target directory.
+            log (typing.Callable[..., None]): Log function.
+            strategy (str): One of clone_strategies. full clones all history, blobless all history without file
+            contents (which are fetched on demand), shallow only the latest commit and single-branch only the history
+            of a single branch or tag.
+            ref (typing.Optional[str]): Branch or tag that will be checked out. Shallow and single-branch clones
+            retrieve this ref instead of the default branch.
+            submodule_jobs (int): Number of submodules that are fetched at the same time.
+
+        Returns:
+            Repository: Cloned repository.
+        """
+        if strategy not in clone_strategies:
+            raise RuntimeError(f"Unknown clone strategy {strategy}, expected one of {', '.join(clone_strategies)}.")
+
+        options = []
+        if strategy == "blobless":
+            options.append("--filter=blob:none")
+        elif strategy == "shallow":
+            options.append("--depth=1")
+        elif strategy == "single-branch":
+            options.append("--single-branch")
+        if strategy in ["shallow", "single-branch"] and ref:
+            options.append(f"--branch={ref}")
+
+        # Git refuses to clone into a folder that is not empty, and cleaning up after a failed clone would remove files
+        # that were there before.
+        existed = os.path.isdir(target)
+        if existed and os.listdir(target):
+            raise RuntimeError(f"Cannot clone {url} to {target}, the folder exists and is not empty.")
+
+        log(f"Cloning repository from {url} to {target} ({strategy}).")
+        with span("clone", url=url, target=target, strategy=strategy):
+            try:
+                check_call_logged(["git", "clone", "--quiet", *options, url, target], log)
+            except subprocess.CalledProcessError:
+                # Only branches and tags can be cloned directly. For anything else (e.g. a commit), the default branch
+                # is cloned with the same strategy, and the ref is fetched on its own.
+                if not any(o.startswith("--branch=") for o in options):
+                    raise
+                log(f"Failed to clone {ref} directly. Cloning the default branch and fetching {ref} instead.")
+                if existed:
+                    for name in os.listdir(target):
+                        path = os.path.join(target, name)
+                        if os.path.isdir(path) and not os.path.islink(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+                else:
+                    shutil.rmtree(target, ignore_errors=True)
+                check_call_logged(["git", "clone", "--quiet", *(o for o in options if not o.startswith("--branch=")),
+                                   url, target], log)
+                check_call_logged(["git", "-C", target, "fetch", "--quiet",
+                                   *(["--depth=1"] if strategy == "shallow" else []), "origin", ref], log)
+
+        # Retrieve all submodules at the same time.
+        if os.path.exists(os.path.join(target, ".gitmodules")):
+            log("Updating submodules.")
+            with span("submodule update", repo=target, jobs=submodule_jobs):
+                check_call_logged(["git", "-C", target, "submodule", "update", "--init",
+                                   f"--jobs={max(1, submodule_jobs)}",
+                                   *(["--depth=1"] if strategy == "shallow" else [])], log)
+
+        return Repository.open(target)
+
+    @staticmethod
+    def open_or_clone_url(url, target, log: typing.Callable[..., None] = print, strategy: str = "full",
+                          ref: typing.Optional[str] = None, submodule_jobs: int = 1) -> Repository:
+        if Repository.exists(target):
+            log(f"Opening existing repository at {target}.")
+            repo = Repository.open(target)
+        else:
+            repo = GitUtils.clone_url(url, target, log, strategy, ref, submodule_jobs)
 
         return repo
     
     @staticmethod
-    def open_or_clone_project(project: str, target: str, config: configparser.ConfigParser) -> typing.Tuple[git.Repo, typing.Iterable[str]]:
+    def is_checked_out(repo: Repository, ref: str) -> bool:
+        """Check if a branch, tag or commit is checked out. For a branch, HEAD has to be on that branch, instead of
+        detached or on another branch at the same commit, since checking it out would still switch branches.
+
+        Args:
+            repo (Repository): Repository.
+            ref (str): Branch, tag or commit.
+
+        Returns:
+            bool: True if checking out the ref would change nothing.
+        """
+        commit, branch = repo.head()
+        if commit is None or commit != repo.resolve(ref):
+            return False
+        if repo.read_ref(f"refs/heads/{ref}") or repo.read_ref(f"refs/remotes/origin/{ref}"):
+            return branch == f"refs/heads/{ref}"
+        return True
+
+    @staticmethod
+    def open_or_clone_project(project: str, target: str, config: configparser.ConfigParser,
+                              log: typing.Callable[..., None] = print,
+                              strategy: typing.Optional[str] = None) -> typing.Tuple[Repository, typing.Iterable[str]]:
         problems = []
 
         # Split into project name and optional tag.
@@ -55,24 +636,137 @@ class GitUtils:
         if "/" in project:
             project, tag = project.split("/")
 
-        # Determine URL.
-        if config.getboolean("default", "http"):
-            url = f"https://github.com/TimZoet/{project}.git"
-        else:
-            url = f"git@github.com:TimZoet/{project}.git"
+        url = get_project_url(config, project)
 
         # Determine source directory.
         # source = os.path.join(config["default"]["projectdir"], project, "source")
 
-        repo = GitUtils.open_or_clone_url(url, target)
+        strategy = strategy or config.get("clone", "strategy", fallback="full")
+        repo = GitUtils.open_or_clone_url(url, target, log, strategy, tag,
+                                          config.getint("clone", "submodule_jobs", fallback=8))
 
-        if tag:
-            print(f"Checking out {tag}.")
+        # Nothing to do if the tag is checked out already.
+        if tag and not GitUtils.is_checked_out(repo, tag):
+            log(f"Checking out {tag}.")
             try:
-                repo.git.checkout(tag)
+                with span("checkout", project=project, tag=tag):
+                    check_call_logged(["git", "-C", target, "checkout", "--quiet", tag], log)
             except Exception as e:
-                print(f"Failed to check out specific branch due to the following error: {e}.")
+                log(f"Failed to check out specific branch due to the following error: {e}.")
                 problems.append(f"Failed to checkout branch {tag} for {url} at {target}.")
                 repo = None
 
         return repo, problems
+
+class MirrorCache:
+    """Persistent bare mirrors of remote repositories, stored in the cache directory. A mirror is only fetched from
+    when it does not contain a requested tag or commit yet, so checking out tags that were used before needs no
+    network access. Branches are fetched every time, since they may have moved.
+    Mirrors that were not used for a while, or that exceed the total size limit, are evicted.
+    """
+    locks = {}
+    locks_lock = threading.Lock()
+
+    def __init__(self, root: str, max_size: int, max_age: float) -> None:
+        self.root = root
+        self.max_size = max_size
+        self.max_age = max_age
+
+    @staticmethod
+    def from_config(config: configparser.ConfigParser) -> "MirrorCache":
+        return MirrorCache(get_cache_dir("mirrors"),
+                           config.getint("mirror", "max_size_mb", fallback=4096) * 1024 * 1024,
+                           config.getfloat("mirror", "max_age_days", fallback=30) * 24 * 3600)
+
+    def lock(self, path: str) -> threading.Lock:
+        with MirrorCache.locks_lock:
+            return MirrorCache.locks.setdefault(path, threading.Lock())
+
+    def path(self, url: str) -> str:
+        name = url.rstrip("/").split("/")[-1].split(":")[-1]
+        if name.endswith(".git"):
+            name = name[:-4]
+        return os.path.join(self.root, f"{name}-{hashlib.sha1(url.encode()).hexdigest()[:8]}.git")
+
+    @staticmethod
+    def contains(path: str, ref: str) -> bool:
+        return Repository.open(path).resolve(ref) is not None
+
+    def get(self, url: str, ref: str, log: typing.Callable[..., None] = print) -> str:
+        """Get the mirror of a repository that contains a ref. The mirror is created or fetched from only if needed.
+
+        Args:
+            url (str): Repository URL.
+            ref (str): Branch, tag or commit that is required.
+            log (typing.Callable[..., None]): Log function.
+
+        Returns:
+            str: Path to bare repository.
+        """
+        path = self.path(url)
+        with self.lock(path):
+            if not os.path.exists(path):
+                log(f"Creating mirror of {url}.")
+                # Clone next to the final location and move it into place, so that an interrupted clone does not
+                # leave a broken mirror behind.
+                tmp = tempfile.mkdtemp(dir=self.root)
+                try:
+                    with span("mirror clone", url=url):
+                        check_call_logged(["git", "clone", "--mirror", "--quiet", url, os.path.join(tmp, "repo")], log)
+                    os.rename(os.path.join(tmp, "repo"), path)
+                finally:
+                    shutil.rmtree(tmp, ignore_errors=True)
+            elif Repository.open(path).read_ref(f"refs/heads/{ref}") or not MirrorCache.contains(path, ref):
+                # Tags and commits never change once they are in the mirror, but branches move.
+                log(f"Fetching {url} into mirror.")
+                with span("mirror fetch", url=url, ref=ref):
+                    check_call_logged(["git", "-C", path, "fetch", "--quiet", "--prune", "--tags", "origin"], log)
+
+            with open(os.path.join(path, "devtools-last-used"), mode="w"):
+                pass
+
+        return path
+
+    def checkout(self, url: str, ref: str, target: str, log: typing.Callable[..., None] = print,
+                 clone: bool = False) -> None:
+        """Write the tree of a ref, including all submodules, to a folder. All repositories are read from mirrors.
+
+        Args:
+            url (str): Repository URL.
+            ref (str): Branch, tag or commit.
+            target (str): Target folder.
+            log (typing.Callable[..., None]): Log function.
+            clone (bool): Always clone the repository itself, see GitUtils.write_tree.
+        """
+        mirror = self.get(url, ref, log)
+        log(f"Checking out {ref} of {url} to {target}.")
+        GitUtils.write_tree(mirror, ref, target, url, log, clone)
+        for path, commit, sub_url in GitUtils.list_submodules(mirror, ref):
+            self.checkout(resolve_url(url, sub_url), commit, os.path.join(target, path), log)
+
+    def evict(self, log: typing.Callable[..., None] = print) -> None:
+        """Remove mirrors that were not used for longer than the maximum age, and then the least recently used mirrors
+        until the total size is below the maximum size.
+
+        Args:
+            log (typing.Callable[..., None]): Log function.
+        """
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith(".git") or not os.path.isdir(path):
+                continue
+            stamp = os.path.join(path, "devtools-last-used")
+            used = os.path.getmtime(stamp) if os.path.exists(stamp) else os.path.getmtime(path)
+            size = sum(os.path.getsize(os.path.join(r, f)) for r, _, files in os.walk(path) for f in files)
+            mirrors.append((used, size, path))
+
+        now = time.time()
+        total = sum(m[1] for m in mirrors)
+        for used, size, path in sorted(mirrors):
+            if now - used > self.max_age or total > self.max_size:
+                with self.lock(path):
+                    log(f"Evicting mirror {path}.")
+                    Repository.forget(path)
+                    shutil.rmtree(path, ignore_errors=True)
+                total -= size
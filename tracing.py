@@ -0,0 +1,107 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import typing
+
+class Tracer:
+    """Records timed spans of work (clones, exports, graph loads, etc.) from all threads. Spans are only recorded once
+    tracing is enabled, so instrumented code costs next to nothing otherwise. The result is written in the Chrome
+    trace event format, which can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+    enabled = False
+    events = []
+    lock = threading.Lock()
+    origin = time.perf_counter()
+
+    @staticmethod
+    def enable(enabled: bool = True) -> None:
+        """Start (or stop) recording spans. Previously recorded spans are discarded."""
+        with Tracer.lock:
+            Tracer.enabled = enabled
+            Tracer.events = []
+            Tracer.origin = time.perf_counter()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def span(name: str, **args) -> typing.Iterator[None]:
+        """Record the duration of a block of code.
+
+        Args:
+            name (str): Name of the span, e.g. clone or export.
+            **args: Additional information to attach to the span, such as the project name.
+        """
+        if not Tracer.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - Tracer.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {k: str(v) for k, v in args.items()}
+            }
+            with Tracer.lock:
+                Tracer.events.append(event)
+
+    @staticmethod
+    def save(path: str) -> None:
+        with Tracer.lock:
+            events = list(Tracer.events)
+
+        # Name the threads, so that the trace viewer does not just show their identifiers.
+        names = {threading.main_thread().ident: "main"}
+        for e in events:
+            names.setdefault(e["tid"], f"worker {len(names)}")
+        meta = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in names.items()]
+
+        with open(path, encoding="UTF8", mode="w") as f:
+            json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f)
+
+    @staticmethod
+    def summary(limit: int = 15) -> None:
+        """Print the total time, number of calls and longest call per span name."""
+        totals = {}
+        with Tracer.lock:
+            for e in Tracer.events:
+                count, total, longest = totals.get(e["name"], (0, 0.0, 0.0))
+                totals[e["name"]] = (count + 1, total + e["dur"] / 1e6, max(longest, e["dur"] / 1e6))
+
+        print("")
+        print(f"{'span':<24}  {'count':>6}  {'total':>9}  {'max':>9}")
+        for name, (count, total, longest) in sorted(totals.items(), key=lambda t: -t[1][1])[:limit]:
+            print(f"{name:<24}  {count:>6}  {total:>8.2f}s  {longest:>8.2f}s")
+
+def span(name: str, **args) -> typing.ContextManager[None]:
+    return Tracer.span(name, **args)
+
+def traced(name: str) -> typing.Callable:
+    """Decorator that records every call of a function as a span. The arguments of the call are attached to the span,
+    except for config objects and log functions.
+
+    Args:
+        name (str): Name of the span.
+    """
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not Tracer.enabled:
+                return func(*args, **kwargs)
+
+            import inspect
+            bound = inspect.signature(func).bind(*args, **kwargs).arguments
+            with Tracer.span(name, **{k: v for k, v in bound.items() if k not in ["config", "log", "self"]}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
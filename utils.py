@@ -1,8 +1,13 @@
+import concurrent.futures
 import configparser
+import io
 import os
 import pathlib
+import subprocess
 import typing
 
+from tracing import span
+
 known_projects = [
     "alexandria",
     "bettertest",
@@ -17,14 +22,53 @@ known_projects = [
 ]
 
 def filter_known_projects(projects):
-    # Drop duplicate and unknown projects.
-    return list(p for p in set(projects) if p.split("/")[0] in known_projects)
+    # Drop duplicate and unknown projects, keeping the original order.
+    return list(p for p in dict.fromkeys(projects) if p.split("/")[0] in known_projects)
+
+# Parsed config files by path, with the modification time they had when they were read.
+config_cache = {}
 
 def get_config():
+    path = os.path.join(os.getenv("DEVTOOLS_ROOT_DIR"), "devtools.ini")
+    mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    if path in config_cache and config_cache[path][0] == mtime:
+        return config_cache[path][1]
+
     config = configparser.ConfigParser()
-    config.read(os.path.join(os.getenv("DEVTOOLS_ROOT_DIR"), "devtools.ini"))
+    config.read(path)
+    config_cache[path] = (mtime, config)
     return config
 
+def get_project_url(config: configparser.ConfigParser, project: str) -> str:
+    """Get the URL of the repository of a project. The url option in the default section of the config can override
+    the GitHub URL with a template, e.g. /srv/git/{project}.git for a local mirror of all repositories.
+
+    Args:
+        config (configparser.ConfigParser): Config.
+        project (str): Project name.
+
+    Returns:
+        str: URL.
+    """
+    if config.has_option("default", "url"):
+        return config.get("default", "url", raw=True).format(project=project)
+    if config.getboolean("default", "http"):
+        return f"https://github.com/TimZoet/{project}.git"
+    return f"git@github.com:TimZoet/{project}.git"
+
+def get_cache_dir(*parts: str) -> str:
+    """Get (and create if needed) a directory for persistent devtools state, inside the root directory.
+
+    Args:
+        *parts (str): Subdirectories, joined with the cache directory.
+
+    Returns:
+        str: Path to directory.
+    """
+    path = os.path.join(os.getenv("DEVTOOLS_ROOT_DIR"), "cache", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
 def get_arg_project(args) -> typing.Tuple[bool, typing.Optional[str], typing.Optional[str]]:
     """Retrieve an explicit project name from the parser arguments, or try to derive from the current working
     directory.
@@ -35,7 +79,18 @@ def get_arg_project(args) -> typing.Tuple[bool, typing.Optional[str], typing.Opt
     Returns:
         typing.Tuple[bool, typing.Optional[str], typing.Optional[str]]: success, project, tag
     """
-    project = args.project
+    return resolve_project(args.project)
+
+def resolve_project(project: typing.Optional[str]) -> typing.Tuple[bool, typing.Optional[str], typing.Optional[str]]:
+    """Split an explicit project name into project and tag, or try to derive the project from the current working
+    directory.
+
+    Args:
+        project (typing.Optional[str]): Project name and optional tag, or None.
+
+    Returns:
+        typing.Tuple[bool, typing.Optional[str], typing.Optional[str]]: success, project, tag
+    """
     tag = None
 
     # If no explicit project was given, try to derive from the current directory. This is done by subtracting the
@@ -57,3 +112,104 @@ def get_arg_project(args) -> typing.Tuple[bool, typing.Optional[str], typing.Opt
         return False, project, tag
 
     return True, project, tag
+
+def check_call_logged(cmd: typing.List[str], log: typing.Callable[..., None] = print, **kwargs) -> None:
+    """Like subprocess.check_call, but the output of the command is passed to a log function instead of being written
+    to the console directly. Useful for commands that run inside of a job.
+
+    Args:
+        cmd (typing.List[str]): Command.
+        log (typing.Callable[..., None]): Log function.
+        **kwargs: Passed on to subprocess.run.
+    """
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, **kwargs)
+    if result.stdout:
+        log(result.stdout, end="" if result.stdout.endswith("\n") else "\n")
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout)
+
+def topological_waves(graph: typing.Dict[str, typing.Iterable[str]]) -> typing.List[typing.List[str]]:
+    """Split a dependency graph into waves. Each wave only depends on items in earlier waves, so all items in a wave
+    can be processed at the same time. Dependencies that are not part of the graph are ignored. Waves are sorted to
+    make the order deterministic.
+
+    Args:
+        graph (typing.Dict[str, typing.Iterable[str]]): Mapping of each item to the items it depends on.
+
+    Returns:
+        typing.List[typing.List[str]]: Waves.
+    """
+    remaining = {k: set(v) & set(graph) for k, v in graph.items()}
+    waves = []
+    while remaining:
+        wave = sorted(k for k, deps in remaining.items() if not deps & set(remaining))
+        if not wave:
+            raise RuntimeError(f"Circular dependency between {', '.join(sorted(remaining))}.")
+        waves.append(wave)
+        for k in wave:
+            del remaining[k]
+    return waves
+
+class JobOutput:
+    """Buffers everything a single job prints so that it can be written to the console as one block once the job is
+    done. Instances can be called like print. When jobs run one at a time there is nothing to interleave with, so
+    output is streamed to the console directly instead.
+    """
+    def __init__(self, title: str, stream: bool = False) -> None:
+        self.title = title
+        self.stream = stream
+        self.buffer = io.StringIO()
+
+    def __call__(self, *args, **kwargs) -> None:
+        if self.stream:
+            if self.title:
+                print(f"----- {self.title} -----")
+                self.title = None
+            print(*args, **kwargs)
+            return
+        print(*args, **kwargs, file=self.buffer)
+
+    def flush(self) -> None:
+        # Jobs that did not print anything are left out entirely.
+        if self.stream or not self.buffer.getvalue():
+            return
+        print(f"----- {self.title} -----")
+        print(self.buffer.getvalue(), end="")
+
+def run_jobs(items: typing.Iterable[str],
+             func: typing.Callable[[str, JobOutput], typing.Iterable[str]],
+             jobs: int = 1) -> typing.List[str]:
+    """Run a function for a number of items on a pool of worker threads. The output of each job is buffered and printed
+    as one block when it finishes, unless there is a single worker, in which case it is streamed. A failing job does
+    not cancel any of the other jobs.
+
+    Args:
+        items (typing.Iterable[str]): Items (usually project names) to run the function for.
+        func (typing.Callable[[str, JobOutput], typing.Iterable[str]]): Function that takes an item and an output
+        buffer and returns a list of problems.
+        jobs (int): Maximum number of concurrent jobs.
+
+    Returns:
+        typing.List[str]: Combined list of problems of all jobs.
+    """
+    problems = []
+
+    def run(item: str, out: JobOutput) -> typing.Iterable[str]:
+        try:
+            with span("job", item=item):
+                return func(item, out) or []
+        except Exception as e:
+            out(f"Unexpected error: {e}")
+            return [f"Unexpected error for {item}: {e}"]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+        for item in items:
+            out = JobOutput(item, jobs <= 1)
+            futures[executor.submit(run, item, out)] = out
+
+        for future in concurrent.futures.as_completed(futures):
+            futures[future].flush()
+            problems.extend(future.result())
+
+    return problems